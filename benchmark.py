@@ -0,0 +1,353 @@
+"""
+Benchmark suite for MineSweeper.
+
+Times the expensive parts of the game on seeded boards, from the 9x9 preset
+up to 2000x2000:
+
+generation           creating a Game: field, mines, counts and empty areas
+count_surroundings   looking up the number of every square on the board
+floodfill            opening an empty area from a square near the middle
+floodfill_rescanning the same with the old rescanning floodfill (--baseline)
+mouse_handler        one click through minesweeper.py, including tile updates
+draw_handler         drawing one frame in minesweeper.py
+startup              starting minesweeper.py until its menu asks for a choice
+
+The handlers are timed against a stub sweeperlib that does nothing, so the
+suite runs on a headless machine without pyglet, and measures the game's
+own work. Startup is timed by running minesweeper.py in a new process, and
+the suite exits with an error if it takes longer than --startup-budget, or
+if minesweeper.py exits before showing its menu. A summary table is printed
+to stderr, and the results as JSON to stdout or to the --output file, for
+tracking them over time. --compare prints how the results differ from an
+earlier JSON file.
+
+Usage: python benchmark.py [--boards 9x9x10 1000x1000x10000 ...] [--repeats 5]
+                           [--seed 1] [--baseline] [--output results.json]
+                           [--compare old.json] [--startup-budget 0.25]
+"""
+
+import argparse
+import json
+import platform
+import os
+import statistics
+import subprocess
+import sys
+import time
+import types
+from datetime import datetime
+from montecarlo import parse_custom
+from sweeperengine import Game, DIFFICULTIES, MINE, REVEALED
+
+"""
+Boards benchmarked by default: the presets, and larger sparse boards with big empty areas.
+"""
+DEFAULT_BOARDS = [
+    DIFFICULTIES["easy"],
+    DIFFICULTIES["medium"],
+    DIFFICULTIES["hard"],
+    {"width": 100, "height": 100, "mines": 500},
+    {"width": 500, "height": 500, "mines": 5000},
+    {"width": 1000, "height": 1000, "mines": 10000},
+    {"width": 2000, "height": 2000, "mines": 40000}
+]
+
+"""
+Longest time in seconds minesweeper.py may take to show its menu.
+The menu doesn't need pyglet, so it shouldn't wait for it.
+"""
+STARTUP_BUDGET = 0.25
+
+def rescanning_count_surroundings(game, row, column):
+    """
+    Counts how many mines surrounds the given position by scanning the field.
+    This is how counting was done before the counts were precomputed.
+
+    param: game: game to count in
+    param: row, column: position to check
+    """
+
+    mines = 0
+    for i in range(row-1, row+2):
+        if i < 0 or i == game.height:
+            continue
+        for j in range(column-1, column+2):
+            if j < 0 or j == game.width:
+                continue
+            elif game.field[i*game.width + j] & MINE:
+                mines += 1
+
+    return mines
+
+def rescanning_floodfill(game, starting_row, starting_column):
+    """
+    Floodfill as it was before counts and empty areas were precomputed:
+    counts mines with rescanning_count_surroundings, and may check the same square many times.
+
+    param: game: game to open squares in
+    param: starting_row, starting_column: position on where to start
+    """
+
+    checklist = [(starting_row, starting_column)]
+
+    while checklist:
+        row, column = checklist.pop()
+        surrounds = rescanning_count_surroundings(game, row, column)
+        game.field[row*game.width + column] |= REVEALED
+
+        if surrounds == 0:
+            for i in range(row-1, row+2):
+                if i < 0 or i == game.height:
+                    continue
+                for j in range(column-1, column+2):
+                    if j < 0 or j == game.width:
+                        continue
+                    elif not game.field[i*game.width + j] & REVEALED:
+                        checklist.append((i, j))
+
+def install_stub_sweeperlib():
+    """
+    Puts a stub module in place of sweeperlib, and imports minesweeper with it.
+    Every function of the stub does nothing, so the handlers of minesweeper.py
+    can be timed without pyglet or a display. Only screen_to_tile does its job,
+    as if the camera was at its starting place, so clicks reach the game.
+    """
+
+    def nothing(*args, **kwargs):
+        pass
+
+    stub = types.ModuleType("sweeperlib")
+    stub.__getattr__ = lambda name: nothing
+    stub.screen_to_tile = lambda x, y: (int(x // 40), int(y // 40))
+    sys.modules["sweeperlib"] = stub
+    import minesweeper
+    minesweeper.sweeperlib = stub
+    return minesweeper
+
+def find_start(game):
+    """
+    Returns a square to start opening from: an empty square as near the middle as possible,
+    or any safe square if there are no empty ones.
+
+    param: game: game to search
+    """
+
+    safe = None
+    middle = game.height // 2
+    for offset in range(game.height):
+        for row in (middle - offset, middle + offset):
+            if not 0 <= row < game.height:
+                continue
+            for column in range(game.width):
+                if not game.field[row*game.width + column] & MINE:
+                    if not game.count_surroundings(row, column):
+                        return row, column
+                    if safe is None:
+                        safe = (row, column)
+    return safe
+
+def measure(function, reset, repeats, number):
+    """
+    Times a function. The function is called number times per repeat, with reset called
+    before each call, untimed. Returns the mean time of one call for each repeat.
+
+    param: function: function to time
+    param: reset: function restoring the state the timed function changes
+    param: repeats: number of repeats
+    param: number: calls per repeat
+    """
+
+    times = []
+    for _ in range(repeats):
+        total = 0
+        for _ in range(number):
+            reset()
+            start = time.perf_counter()
+            function()
+            total += time.perf_counter() - start
+        times.append(total / number)
+    return times
+
+def measure_startup(repeats):
+    """
+    Times starting minesweeper.py in a new process, until its menu prints the prompt.
+    Returns a result dictionary like those of benchmark_board.
+    Raises RuntimeError if it exits before printing the prompt.
+
+    param: repeats: number of times to start it
+    """
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "minesweeper.py")
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, path], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+        output = b""
+        while b"Choose:" not in output:
+            data = process.stdout.read1(4096)
+            if not data:
+                break
+            output += data
+        times.append(time.perf_counter() - start)
+        process.kill()
+        process.wait()
+        if b"Choose:" not in output:
+            raise RuntimeError("minesweeper.py exited with code {} before showing its menu".format(process.returncode))
+
+    result = {
+        "benchmark": "startup",
+        "board": "",
+        "seed": None,
+        "repeats": repeats,
+        "number": 1,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times)
+    }
+    print("{:>22} {:>16}: median {:10.6f} s".format("startup", "", result["median"]), file=sys.stderr)
+    return result
+
+def benchmark_board(board, seed, repeats, baseline, minesweeper):
+    """
+    Runs the benchmarks on one board, and returns a list of result dictionaries.
+
+    param: board: dictionary with width, height and mines
+    param: seed: seed for placing mines
+    param: repeats: number of repeats for each benchmark
+    param: baseline: True to also time the old rescanning floodfill
+    param: minesweeper: minesweeper module using the stub sweeperlib
+    """
+
+    width, height, mines = board["width"], board["height"], board["mines"]
+    number = max(1, 20000 // (width*height))
+    game = Game(width, height, mines, seed)
+    pristine = bytes(game.field)
+    row, column = find_start(game)
+
+    def reset():
+        game.field[:] = pristine
+        game.current_status = "In progress"
+        game.mines_flagged = 0
+        game.revealed_safe = 0
+        game.changed = []
+
+    def reset_handlers():
+        reset()
+        minesweeper.reset_game_status()
+        minesweeper.game_status["game"] = game
+        minesweeper.settings.update(board)
+        minesweeper.settings["window_width"] = width*40
+        minesweeper.settings["window_height"] = height*40+40
+
+    def count_all():
+        for i in range(height):
+            for j in range(width):
+                game.count_surroundings(i, j)
+
+    benchmarks = [
+        ("generation", lambda: Game(width, height, mines, seed), lambda: None),
+        ("count_surroundings", count_all, lambda: None),
+        ("floodfill", lambda: game.floodfill(row, column), reset)
+    ]
+    if baseline:
+        benchmarks.append(("floodfill_rescanning", lambda: rescanning_floodfill(game, row, column), reset))
+    benchmarks.append(("mouse_handler", lambda: minesweeper.mouse_handler(column*40+20, row*40+20, 1, 0), reset_handlers))
+    benchmarks.append(("draw_handler", minesweeper.draw_handler, reset_handlers))
+
+    results = []
+    for name, function, reset_function in benchmarks:
+        times = measure(function, reset_function, repeats, number)
+        results.append({
+            "benchmark": name,
+            "board": "{}x{}x{}".format(width, height, mines),
+            "seed": seed,
+            "repeats": repeats,
+            "number": number,
+            "min": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.mean(times)
+        })
+        print("{:>22} {:>16}: median {:10.6f} s".format(name, results[-1]["board"], results[-1]["median"]),
+            file=sys.stderr)
+
+    reset()
+    game.floodfill(row, column)
+    opened = sum(1 for square in game.field if square & REVEALED)
+    print("{:>22} {:>16}: {} squares opened".format("", results[-1]["board"], opened), file=sys.stderr)
+    return results
+
+def compare(results, path):
+    """
+    Prints how the results differ from those in an earlier JSON file.
+
+    param: results: list of result dictionaries
+    param: path: path to the earlier results
+    """
+
+    with open(path) as file:
+        old_results = json.load(file)["results"]
+    old = {(result["benchmark"], result["board"]): result["median"] for result in old_results}
+    print("\nCompared to {}:".format(path), file=sys.stderr)
+    for result in results:
+        key = (result["benchmark"], result["board"])
+        if key in old:
+            print("{:>22} {:>16}: {:10.6f} s -> {:10.6f} s ({:+.1%})".format(
+                key[0], key[1], old[key], result["median"], result["median"] / old[key] - 1
+            ), file=sys.stderr)
+
+def main():
+    """
+    Runs the benchmark suite from command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description="Benchmark suite for MineSweeper.")
+    parser.add_argument("--boards", nargs="*", type=parse_custom, default=DEFAULT_BOARDS,
+        help="boards as WIDTHxHEIGHTxMINES")
+    parser.add_argument("--repeats", type=int, default=5, help="repeats of each benchmark")
+    parser.add_argument("--seed", type=int, default=1, help="seed for placing mines")
+    parser.add_argument("--baseline", action="store_true", help="also time the old rescanning floodfill")
+    parser.add_argument("--output", help="file to write JSON results to, stdout by default")
+    parser.add_argument("--compare", help="earlier JSON results to compare to")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET,
+        help="seconds minesweeper.py may take to show its menu")
+    args = parser.parse_args()
+
+    minesweeper = install_stub_sweeperlib()
+    results = []
+    for board in args.boards:
+        results.extend(benchmark_board(board, args.seed, args.repeats, args.baseline, minesweeper))
+    try:
+        startup = measure_startup(args.repeats)
+    except RuntimeError as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+    results.append(startup)
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "system": platform.system()
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        compare(results, args.compare)
+
+    if startup["median"] > args.startup_budget:
+        print("Startup took {:.3f} s, over the budget of {:.3f} s".format(startup["median"], args.startup_budget),
+            file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,22 @@ Minesweeper game made with python, for University of Oulu Elementary Programming
 
 """
 
-import random
+import os
+import sys
+from contextlib import closing
 from datetime import datetime
-from math import floor
-import sweeperlib
+import statsdb
+import replay
+import snapshot
+import noguess
+from sweeperengine import Game, ChunkedGame, DIFFICULTIES
+from solver import Solver
+
+"""
+Helper library for graphics. Imported when the first game window is opened, see load_graphics,
+so the menu and statistics don't need to wait for pyglet and OpenGL, or work without a display.
+"""
+sweeperlib = None
 
 """
 settings, mouse_buttons and game_status
@@ -20,6 +32,12 @@ settings = {
     "width": 0,
     "height": 0,
     "mines": 0,
+    "density": 0,
+    "seed": None,
+    "difficulty": "",
+    "record_replays": False,
+    "no_guess": False,
+    "profile": False,
     "background_color": (255, 255, 255, 255),
     "window_width": 0,
     "window_height": 0
@@ -32,18 +50,42 @@ mouse_buttons = {
 }
 
 game_status = {
-    "current_status": "In progress",
-    "shown_field": [],
-    "hidden_field": [],
-    "mines_flagged": 0,
-    "elapsed_time": 0,
+    "game": None,
+    "solver": None,
+    "hint": None,
+    "recording": None,
     "time_to_quit": 0
 }
 
+"""
+Largest window size. Larger boards are scrolled and zoomed within the window.
+"""
+MAX_WINDOW_WIDTH = 1280
+MAX_WINDOW_HEIGHT = 800
+
+"""
+Amount of pixels the arrow keys scroll the board, and how much one click of the scroll wheel zooms.
+"""
+SCROLL_STEP = 160
+ZOOM_STEP = 1.25
+
+"""
+Text shown on a hinted square, and its color.
+"""
+hint_marks = {
+    "safe": ("o", (0, 150, 0, 255)),
+    "mine": ("!", (200, 0, 0, 255)),
+    "guess": ("?", (0, 0, 200, 255))
+}
+
 def mouse_handler(x, y, button, modifiers):
     """
     Handler function for mouse.
-    If mouse clicked inside playarea, calls check_square with coords.
+    If mouse clicked inside playarea, applies the click to the game as an action
+    on the square under the mouse, as seen through the camera,
+    keeping the chunks of a large board on the screen in memory,
+    updates tiles and the hint solver with the squares it changed,
+    and asks for the window to be redrawn.
     More info on how this is used in sweeperlib.py.
 
     param: x, y: x and y position of click
@@ -51,35 +93,111 @@ def mouse_handler(x, y, button, modifiers):
     param: modifiers: not used
     """
 
-    column = floor(x / 40)
-    row = floor(y / 40)
-    if column < settings["width"] and row < settings["height"]:
-        check_square(row, column, button)
+    tile = sweeperlib.screen_to_tile(x, y)
+    if tile is not None:
+        column, row = tile
+        current_game = game_status["game"]
+        if game_status["recording"] and current_game.current_status == "In progress":
+            replay.record_action(game_status["recording"], current_game.elapsed_time, row, column, button)
+        pressed = mouse_buttons.get(button)
+        if pressed == "left":
+            action = "reveal"
+        elif pressed == "middle":
+            action = "chord"
+        elif pressed == "right":
+            action = "unflag" if current_game.shown_square(row, column) == "f" else "flag"
+        else:
+            return
+        if isinstance(current_game, ChunkedGame):
+            first_column, first_row, end_column, end_row = sweeperlib.visible_tiles()
+            current_game.set_visible(first_row, first_column, end_row, end_column)
+        changes, _ = current_game.apply([(action, row, column)])
+        for changed_row, changed_column, shown in changes:
+            sweeperlib.update_tile(changed_column, changed_row, shown)
+        if game_status["solver"]:
+            game_status["solver"].update([(changed_row, changed_column) for changed_row, changed_column, _ in changes])
+        game_status["hint"] = None
+        sweeperlib.request_redraw()
+
+def keyboard_handler(symbol, modifiers):
+    """
+    Handler function for keyboard.
+    H shows a hint: a safe square, a certain mine, or the square least likely to be a mine.
+    Hints are not available on large boards.
+    S saves the game and returns to the menu, where it can be continued later.
+    Arrow keys scroll the board.
+    More info on how this is used in sweeperlib.py.
+
+    param: symbol: which key is pressed
+    param: modifiers: not used
+    """
+
+    if (symbol == sweeperlib.KEY_H and settings["difficulty"] != "large"
+            and game_status["game"].current_status == "In progress"):
+        if game_status["solver"] is None:
+            game_status["solver"] = Solver(game_status["game"])
+        game_status["hint"] = game_status["solver"].hint()
+        sweeperlib.request_redraw()
+    elif (symbol == sweeperlib.KEY_S and settings["difficulty"] != "large"
+            and game_status["game"].current_status == "In progress"):
+        snapshot.save(game_status["game"], settings["difficulty"])
+        print("Game saved")
+        sweeperlib.close()
+    elif symbol == sweeperlib.KEY_LEFT:
+        sweeperlib.move_camera(-SCROLL_STEP, 0)
+    elif symbol == sweeperlib.KEY_RIGHT:
+        sweeperlib.move_camera(SCROLL_STEP, 0)
+    elif symbol == sweeperlib.KEY_UP:
+        sweeperlib.move_camera(0, SCROLL_STEP)
+    elif symbol == sweeperlib.KEY_DOWN:
+        sweeperlib.move_camera(0, -SCROLL_STEP)
+
+def scroll_handler(x, y, scroll_x, scroll_y):
+    """
+    Handler function for the scroll wheel.
+    Zooms the board in or out around the mouse.
+    More info on how this is used in sweeperlib.py.
+
+    param: x, y: x and y position of mouse
+    param: scroll_x: not used
+    param: scroll_y: clicks scrolled up, negative for down
+    """
+
+    sweeperlib.zoom_camera(ZOOM_STEP ** scroll_y, x, y)
 
 def draw_handler():
     """
     Handler function for drawing.
-    Prepares sprites for shown_field, and draws them. 
+    Draws the tile grid, and the hint if one was asked for. 
     Also draws clock and current game status.    
     More info on how this is used in sweeperlib.py.
     """
 
+    current_game = game_status["game"]
+    status = current_game.current_status
     sweeperlib.clear_window()
     sweeperlib.draw_background()
-    sweeperlib.begin_sprite_draw()
-    for i, row in enumerate(game_status["shown_field"]):
-        for j, square in enumerate(row):
-            sweeperlib.prepare_sprite(square, j*40, i*40)
-    sweeperlib.draw_sprites()
+    sweeperlib.draw_tile_grid()
+    if game_status["hint"]:
+        kind, row, column, probability = game_status["hint"]
+        mark, color = hint_marks[kind]
+        position = sweeperlib.tile_to_screen(column, row)
+        if position is not None:
+            x, y, size = position
+            sweeperlib.draw_text(mark, round(x+size*0.33), round(y+size*0.15), color, "roboto", max(round(size/2), 1))
+        if kind == "guess":
+            status = "Hint: {:.0%} mine".format(probability)
+        else:
+            status = "Hint: {}".format(kind)
     sweeperlib.draw_text(
-        text = "{:.0f}".format(game_status["elapsed_time"]),
+        text = "{:.0f}".format(current_game.elapsed_time),
         x = settings["window_width"]-80,
         y = settings["window_height"]-40,
         font = "roboto",
         size = 24
     )
     sweeperlib.draw_text(
-        text = game_status["current_status"],
+        text = status,
         x = settings["window_width"]/2-100,
         y = settings["window_height"]-40,
         font = "roboto",
@@ -91,258 +209,354 @@ def interval_handler(elapsed):
     """
     Handler function for interval. 
     Used for controlling game clock, with added logic for when to close the game.
+    Asks for a redraw only when the shown second changes.
     More info on how this is used in sweeperlib.py.
 
     param: elapsed: actual time elapsed
     """
 
-    if game_status["current_status"] == "In progress":
-        game_status["elapsed_time"] += elapsed
+    current_game = game_status["game"]
+    if current_game.current_status == "In progress":
+        shown_time = "{:.0f}".format(current_game.elapsed_time)
+        current_game.tick(elapsed)
+        if "{:.0f}".format(current_game.elapsed_time) != shown_time:
+            sweeperlib.request_redraw()
     elif game_status["time_to_quit"] > 5:
         save_stats()
+        save_replay()
         sweeperlib.close()  
-    elif game_status["current_status"] != "In progress":
+    else:
         game_status["time_to_quit"] += elapsed
 
-def create_field():
-    """
-    Creates 2 minefields, hidden and shown.
-    Hidden is used to get mine positions, and shown is used to show the field to the player without the mines.
-    """
-
-    game_status["hidden_field"] = []
-    for _ in range(settings["height"]):
-        game_status["hidden_field"].append([])
-        for _ in range(settings["width"]):
-            game_status["hidden_field"][-1].append(" ")
-
-    game_status["shown_field"] = [row[:] for row in game_status["hidden_field"]]
-
-def insert_mines():
-    """
-    Inserts mines to the hidden field. Positions are chosen randomly
-    """
-
-    free_squares = []
-    for x in range(settings["width"]):
-        for y in range(settings["height"]):
-            free_squares.append((x, y))
-
-    for _ in range(settings["mines"]):
-        square = random.choice(free_squares)
-        free_squares.remove(square)
-        x, y = square
-        game_status["hidden_field"][y][x] = "x"
-        
-def check_square(row, column, button):
-    """
-    Checks clicked square. 
-    Does different things depending on which mouse button is given, and what the square contains.
-
-    param: row: row position of click
-    param: column: column position of click
-    param: button: button used in click
-    """
-
-    square = game_status["hidden_field"][row][column]
-    if button == 1:
-        if square == "x":
-            game_status["shown_field"] = game_status["hidden_field"]
-            game_status["current_status"] = "You lost!"
-        elif square == " ":
-            floodfill(column, row)
-    elif button == 4:
-        if game_status["shown_field"][row][column] == " ":
-            game_status["shown_field"][row][column] = "f"
-            if square == "x":
-                game_status["mines_flagged"] += 1
-                if game_status["mines_flagged"] == settings["mines"]:
-                    game_status["current_status"] = "You won!"
-        elif game_status["shown_field"][row][column] == "f":
-            game_status["shown_field"][row][column] = " "
-            if square == "x":
-                game_status["mines_flagged"] -= 1
-        
-
-def floodfill(starting_x, starting_y):
-    """
-    Using modified floodfill to open up playarea, minesweeper style.
-    Adds squares to be checked to checklist, 
-    calls count_surroundings to count number of mines,
-    and pops them off after check.
-
-    param: starting_x: x position on where to start
-    param: starting_y: y position on where to start
-    """
-
-    checklist = [(starting_x, starting_y)]
-
-    while checklist:
-        x, y = checklist.pop()
-        surrounds = count_surroundings(x, y)
-        game_status["shown_field"][y][x] = surrounds
-        game_status["hidden_field"][y][x] = surrounds
-
-        if surrounds == 0:
-            for i in range(y-1, y+2):
-                if i < 0 or i == settings["height"]:
-                    continue
-                for j in range(x-1, x+2):
-                    if j < 0 or j == settings["width"]:
-                        continue
-                    elif game_status["hidden_field"][i][j] == " ":
-                        checklist.append((j, i))
-
-def count_surroundings(x, y):
-    """
-    Counts how many mines surrounds the given position, and returns the value.
-
-    param: x, y: x and y position to check
-    """
-
-    mines = 0
-    for i in range(y-1, y+2):
-        if i < 0 or i == settings["height"]:
-            continue
-        for j in range(x-1, x+2):
-            if j < 0 or j == settings["width"]:
-                continue
-            elif game_status["hidden_field"][i][j] == "x":
-                mines += 1
-
-    return mines
-
 def reset_game_status():
     """
     Resets all game statuses to defaults
     """
 
-    game_status["current_status"] = "In progress"
-    game_status["shown_field"] = []
-    game_status["hidden_field"] = []
-    game_status["mines_flagged"] = 0
-    game_status["elapsed_time"] = 0
+    game_status["game"] = None
+    game_status["solver"] = None
+    game_status["hint"] = None
+    game_status["recording"] = None
     game_status["time_to_quit"] = 0
 
 
 def menu():
     """
     Main menu for the game.
+    The game window is kept between games, and closed when quitting.
+    With guess-free boards on, boards for the presets are made in the background while the menu waits.
     """
 
     while True:
+        if settings["no_guess"]:
+            noguess.fill()
         print("\n----------------MineSweeper----------------")
         print("(N)ew game")
+        if os.path.exists(snapshot.SAVE_FILE):
+            print("(C)ontinue saved game")
         print("(S)tats")
+        print("(R)ecord replays: {}".format("on" if settings["record_replays"] else "off"))
+        if settings["no_guess"]:
+            print("(G)uess-free boards: on, {} ready".format(
+                ", ".join("{} {}".format(count, name) for name, count in noguess.ready().items())
+            ))
+        else:
+            print("(G)uess-free boards: off")
         print("(Q)uit")
         menu_choice = input("Choose: ").strip().lower()
         if menu_choice == "n":
             game()
+        elif menu_choice == "c" and os.path.exists(snapshot.SAVE_FILE):
+            continue_game()
         elif menu_choice == "s":
             show_stats()
+        elif menu_choice == "r":
+            settings["record_replays"] = not settings["record_replays"]
+        elif menu_choice == "g":
+            settings["no_guess"] = not settings["no_guess"]
+            if not settings["no_guess"]:
+                noguess.shutdown()
         elif menu_choice == "q":
             print("Thanks for playing!")
+            noguess.shutdown()
+            if sweeperlib:
+                sweeperlib.end_session()
             break
         else:
             print("Incorrect choice")
 
 def game():
     """
-    New game menu. Depending on user input, creates minefield, 
-    attaches handlers to helper library and starts game.
+    New game menu. Depending on user input, creates minefield and starts game.
+    With guess-free boards on, presets are played on a ready guess-free board, opened from its start square,
+    or on a random board if none is ready.
     """
 
+    settings["seed"] = None
     while True:
         print("\nDifficulty?")
         print("(E)asy - 9x9, 10 mines")
         print("(M)edium - 16x16, 40 mines")
         print("(H)ard - 16x30, 99 mines")
         print("(C)ustom")
+        print("(L)arge - scrolling board made as you play")
         print("(B)ack to menu")
         game_choice = input("Choose: ").strip().lower()
         if game_choice == "e":
-            settings["height"] = 9
-            settings["width"] = 9
-            settings["mines"] = 10
+            settings.update(DIFFICULTIES["easy"])
+            settings["difficulty"] = "easy"
             break
         elif game_choice == "m":
-            settings["height"] = 16
-            settings["width"] = 16
-            settings["mines"] = 40
+            settings.update(DIFFICULTIES["medium"])
+            settings["difficulty"] = "medium"
             break
         elif game_choice == "h":
-            settings["height"] = 16
-            settings["width"] = 30
-            settings["mines"] = 99
+            settings.update(DIFFICULTIES["hard"])
+            settings["difficulty"] = "hard"
             break
         elif game_choice == "c":
             try:
                 settings["height"] = int(input("Height: "))
                 settings["width"] = int(input("Width: "))
                 settings["mines"] = int(input("Mines: "))
+                seed = input("Seed (empty for random): ").strip()
+                settings["seed"] = int(seed) if seed else None
+                settings["difficulty"] = "custom"
             except ValueError:
                 print("Please input whole numbers only!")
             else:
-                if settings["mines"] == 0:
+                if settings["height"] < 1 or settings["width"] < 1:
+                    print("The board needs at least one square!")
+                elif settings["mines"] <= 0:
                     print("Not enough mines!")
                 elif settings["mines"] > settings["height"]*settings["width"]:
                     print("Too many mines!")
                 else:
                     break
+        elif game_choice == "l":
+            try:
+                settings["height"] = int(input("Height: "))
+                settings["width"] = int(input("Width: "))
+                settings["density"] = int(input("Mines (% of squares): ")) / 100
+                seed = input("Seed (empty for random): ").strip()
+                settings["seed"] = int(seed) if seed else None
+                settings["difficulty"] = "large"
+            except ValueError:
+                print("Please input whole numbers only!")
+            else:
+                if settings["density"] <= 0:
+                    print("Not enough mines!")
+                elif settings["density"] >= 1:
+                    print("Too many mines!")
+                elif settings["height"] < 1 or settings["width"] < 1:
+                    print("The board needs at least one square!")
+                else:
+                    break
         elif game_choice == "b":
             return
         else:
             print("Incorrect choice")
     
+    board = None
+    if settings["no_guess"] and settings["difficulty"] in DIFFICULTIES:
+        board = noguess.take(settings["difficulty"])
+        if board is None:
+            print("No guess-free board is ready yet, playing a random one.")
+
     reset_game_status()
-    settings["window_width"] = settings["width"]*40
-    settings["window_height"] = settings["height"]*40+40
+    if settings["difficulty"] == "large":
+        game_status["game"] = ChunkedGame(settings["width"], settings["height"], settings["density"], settings["seed"])
+    elif board is None:
+        game_status["game"] = Game(settings["width"], settings["height"], settings["mines"], settings["seed"])
+        if settings["record_replays"]:
+            game_status["recording"] = replay.new_recording(game_status["game"])
+    else:
+        seed, row, column = board
+        game_status["game"] = Game(settings["width"], settings["height"], settings["mines"], seed, start=(row, column))
+        if settings["record_replays"]:
+            game_status["recording"] = replay.new_recording(game_status["game"])
+            replay.record_action(game_status["recording"], 0, row, column, 1)
+        game_status["game"].reveal(row, column)
+        game_status["game"].pop_changes()
+    start_game(settings["difficulty"] == "large" or board is not None)
+
+def continue_game():
+    """
+    Continues the saved game, see snapshot.py. The save is removed,
+    so the game can't be continued again from the same point.
+    """
 
-    create_field()
-    insert_mines()
+    try:
+        saved_game, difficulty = snapshot.load()
+    except ValueError as error:
+        print("Couldn't load the saved game: {}".format(error))
+        return
+    snapshot.remove()
 
-    sweeperlib.load_sprites("sprites")
+    reset_game_status()
+    game_status["game"] = saved_game
+    settings["width"] = saved_game.width
+    settings["height"] = saved_game.height
+    settings["mines"] = saved_game.mines
+    settings["seed"] = saved_game.seed
+    settings["difficulty"] = difficulty
+    start_game(True)
+
+def start_game(lazy_grid):
+    """
+    Opens the game window for the game in game_status, attaches handlers to helper library and starts game.
+
+    param: lazy_grid: True to read tiles from the game as they come into view,
+        for large or already opened boards, instead of starting from an unopened grid
+    """
+
+    settings["window_width"] = min(settings["width"]*40, MAX_WINDOW_WIDTH)
+    settings["window_height"] = min(settings["height"]*40, MAX_WINDOW_HEIGHT-40)+40
+
+    load_graphics()
     sweeperlib.create_window(settings["window_width"], settings["window_height"], settings["background_color"])
+    sweeperlib.load_sprites("sprites")
+    if lazy_grid:
+        sweeperlib.create_lazy_tile_grid(
+            settings["width"],
+            settings["height"],
+            lambda column, row: game_status["game"].shown_square(row, column)
+        )
+    else:
+        sweeperlib.create_tile_grid([" "] * settings["width"] for _ in range(settings["height"]))
+    sweeperlib.set_viewport(0, 0, settings["window_width"], settings["window_height"]-40)
     sweeperlib.set_mouse_handler(mouse_handler)
+    sweeperlib.set_keyboard_handler(keyboard_handler)
+    sweeperlib.set_scroll_handler(scroll_handler)
     sweeperlib.set_draw_handler(draw_handler)
-    sweeperlib.set_interval_handler(interval_handler)
+    sweeperlib.set_interval_handler(interval_handler, 1/10)
+    sweeperlib.set_redraw_on_demand(True)
     sweeperlib.start()
 
+def load_graphics():
+    """
+    Imports the helper library the first time a game window is opened,
+    and sets it up to keep the window between games.
+    """
+
+    global sweeperlib
+    if sweeperlib is None:
+        import sweeperlib
+        sweeperlib.set_persistent_session(True)
+        if settings["profile"]:
+            sweeperlib.set_profiling(True, output="profile.json")
+
 def save_stats():
     """
-    Used to save statistics after game. Saves to stats.txt
+    Used to save statistics after game. Saves to the statistics database, see statsdb.py
     """
 
-    date_and_time = datetime.now().strftime("%d.%m.%Y %H:%M")
-    m, s = divmod(int(game_status["elapsed_time"]), 60)
-    game_time = "{:02d}:{:02d}".format(m, s)
-    mine_status = "{}/{}".format(game_status["mines_flagged"], settings["mines"])
-    
-    game_statistics = {
-        "Date and time": date_and_time,
-        "Duration": game_time,
-        "Outcome": game_status["current_status"],
-        "Mines flagged": mine_status
-    }
+    current_game = game_status["game"]
+    with closing(statsdb.connect()) as connection, connection:
+        statsdb.record_game(
+            connection,
+            difficulty=settings["difficulty"],
+            width=current_game.width,
+            height=current_game.height,
+            mines=current_game.mines,
+            mines_flagged=current_game.mines_flagged,
+            duration=current_game.elapsed_time,
+            outcome=statsdb.OUTCOMES[current_game.current_status]
+        )
+
+
+def format_duration(seconds):
+    """
+    Returns a duration as minutes and seconds, e.g. 01:05. Returns "-" for None.
+
+    param: seconds: duration in seconds
+    """
+
+    if seconds is None:
+        return "-"
+    m, s = divmod(int(seconds), 60)
+    return "{:02d}:{:02d}".format(m, s)
 
-    with open("stats.txt", "a+") as file:
-        file.write(str(game_statistics) + "\n")
+def save_replay():
+    """
+    Saves the replay of the game if it was recorded, see replay.py
+    """
 
+    if game_status["recording"]:
+        path = replay.save(replay.encode(game_status["recording"], game_status["game"]))
+        print("Replay saved to {}".format(path))
 
 def show_stats():
     """
-    Used to show player the statistics of previously played games.
+    Used to show player the statistics: totals of each difficulty,
+    and then the history of games, a page at a time.
     """
 
-    try:
-        with open("stats.txt") as file:
-            loaded_stats = file.read()
-    except (IOError):
-        print("Unable to find stats.txt, try playing first?")
-    else:
-        print(loaded_stats)
+    with closing(statsdb.connect()) as connection:
+        difficulties = statsdb.summaries(connection)
+        if not difficulties:
+            print("No statistics yet, try playing first?")
+            return
+
+        print("\n{:<10}{:<8}{:<10}{:<8}{:<8}{}".format("Level", "Games", "Win rate", "Best", "Median", "Streak"))
+        for summary in difficulties:
+            print("{:<10}{:<8}{:<10.1%}{:<8}{:<8}{} {}".format(
+                summary["difficulty"],
+                summary["games"],
+                summary["win_rate"],
+                format_duration(summary["best_time"]),
+                format_duration(summary["median_time"]),
+                summary["streak"],
+                summary["streak_outcome"]
+            ))
+        show_history(connection)
+
+def show_history(connection):
+    """
+    Shows the history of games, newest first, one page at a time.
+    Player can move to the next (older) and previous (newer) page.
+
+    param: connection: open statistics database connection
+    """
+
+    games = statsdb.history_page(connection)
+    while True:
+        print("\n{:<20}{:<10}{:<12}{:<10}{:<10}{}".format("Date and time", "Level", "Board", "Duration", "Outcome", "Mines flagged"))
+        for played in games:
+            if played["width"]:
+                board = "{}x{}".format(played["width"], played["height"])
+            else:
+                board = "-"
+            print("{:<20}{:<10}{:<12}{:<10}{:<10}{}/{}".format(
+                datetime.fromisoformat(played["played_at"]).strftime("%d.%m.%Y %H:%M"),
+                played["difficulty"],
+                board,
+                format_duration(played["duration"]),
+                played["outcome"],
+                played["mines_flagged"],
+                played["mines"]
+            ))
+
+        print("(N)ext page")
+        print("(P)revious page")
+        print("(B)ack to menu")
+        page_choice = input("Choose: ").strip().lower()
+        if page_choice == "n":
+            page = statsdb.history_page(connection, before=games[-1]["id"])
+        elif page_choice == "p":
+            page = statsdb.history_page(connection, after=games[0]["id"])
+        elif page_choice == "b":
+            return
+        else:
+            print("Incorrect choice")
+            continue
+        if page:
+            games = page
+        else:
+            print("No more games that way")
 
 if __name__ == "__main__":
+    settings["profile"] = "--profile" in sys.argv
     try:
         menu()
     except KeyboardInterrupt:
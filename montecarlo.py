@@ -0,0 +1,214 @@
+"""
+Monte Carlo batch runner for MineSweeper.
+
+Plays a large number of seeded games headlessly with a chosen strategy,
+spread over a process pool in chunks, and reports win rate, mean reveals and
+throughput for each board. Used for evaluating solver strategies and
+difficulty settings without opening a window for every game.
+
+A strategy is a generator function taking a sweeperengine.Game and a
+random.Random, and yielding (row, column, button) actions, with buttons as in
+Game.check_square. It may only look at what the player would see, through
+shown_square and pop_changes. Strategies are given either by a name from
+STRATEGIES, or as "module:function".
+
+Usage: python montecarlo.py [--games 10000] [--difficulty easy medium hard]
+                            [--custom 50x50x300 ...] [--strategy random]
+                            [--workers 4] [--chunk 500] [--seed 0]
+"""
+
+import argparse
+import importlib
+import os
+import random
+import time
+from multiprocessing import Pool
+from sweeperengine import Game, DIFFICULTIES
+from solver import Solver
+
+
+def random_strategy(game, generator):
+    """
+    Opens unopened squares in random order.
+    When only as many squares as there are mines are left unopened, flags them all.
+
+    param: game: game to play
+    param: generator: random generator used for choosing squares
+    """
+
+    squares = [(row, column) for row in range(game.height) for column in range(game.width)]
+    generator.shuffle(squares)
+    unopened = len(squares)
+    for row, column in squares:
+        if unopened == game.mines:
+            break
+        if game.shown_square(row, column) == " ":
+            yield row, column, 1
+            unopened -= len(game.pop_changes())
+
+    for row, column in squares:
+        if game.shown_square(row, column) == " ":
+            yield row, column, 4
+
+def solver_strategy(game, generator):
+    """
+    Plays with the hint engine: opens certainly safe squares, flags certain mines,
+    and otherwise opens the square least likely to be a mine.
+
+    param: game: game to play
+    param: generator: not used, the solver is deterministic
+    """
+
+    solver = Solver(game)
+    while True:
+        hint = solver.hint()
+        if hint is None:
+            return
+        kind, row, column, _ = hint
+        yield row, column, 4 if kind == "mine" else 1
+        solver.update(game.pop_changes())
+
+STRATEGIES = {
+    "random": random_strategy,
+    "solver": solver_strategy
+}
+
+def load_strategy(name):
+    """
+    Returns the strategy with the given name from STRATEGIES,
+    or imports it if the name is given as "module:function".
+
+    param: name: name of the strategy
+    """
+
+    if ":" in name:
+        module_name, function_name = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), function_name)
+    return STRATEGIES[name]
+
+def play_game(width, height, mines, seed, strategy):
+    """
+    Plays one game to the end with the given strategy.
+    Returns whether the game was won, and the number of reveals made.
+
+    param: width, height, mines: board parameters
+    param: seed: seed for the board, the strategy gets a generator derived from it
+    param: strategy: strategy function, see module documentation
+    """
+
+    game = Game(width, height, mines, seed)
+    reveals = 0
+    generator = random.Random("strategy {}".format(seed))
+    for row, column, button in strategy(game, generator):
+        if button == 1:
+            reveals += 1
+        game.check_square(row, column, button)
+        if game.current_status != "In progress":
+            break
+
+    return game.current_status == "You won!", reveals
+
+def play_chunk(chunk):
+    """
+    Plays a chunk of consecutively seeded games in a worker process.
+    Returns the number of games, wins and reveals in the chunk.
+
+    param: chunk: tuple of width, height, mines, strategy name, first seed and number of games
+    """
+
+    width, height, mines, strategy_name, first_seed, count = chunk
+    strategy = load_strategy(strategy_name)
+    wins = 0
+    reveals = 0
+    for seed in range(first_seed, first_seed + count):
+        won, game_reveals = play_game(width, height, mines, seed, strategy)
+        wins += won
+        reveals += game_reveals
+
+    return count, wins, reveals
+
+def run_batch(pool, board, games, strategy_name, seed, chunk_size):
+    """
+    Plays the given number of games on one kind of board, and returns the results as a dictionary.
+
+    param: pool: process pool to play in
+    param: board: dictionary with width, height and mines
+    param: games: number of games to play
+    param: strategy_name: name of the strategy, see load_strategy
+    param: seed: seed of the first game, the rest are consecutive
+    param: chunk_size: number of games given to a worker at once
+    """
+
+    chunks = []
+    for first in range(0, games, chunk_size):
+        count = min(chunk_size, games - first)
+        chunks.append((board["width"], board["height"], board["mines"], strategy_name, seed + first, count))
+
+    played = wins = reveals = 0
+    start = time.perf_counter()
+    for count, chunk_wins, chunk_reveals in pool.imap_unordered(play_chunk, chunks):
+        played += count
+        wins += chunk_wins
+        reveals += chunk_reveals
+    duration = time.perf_counter() - start
+
+    return {
+        "games": played,
+        "win_rate": wins / played,
+        "mean_reveals": reveals / played,
+        "games_per_second": played / duration
+    }
+
+def parse_custom(text):
+    """
+    Parses a custom board given as WIDTHxHEIGHTxMINES.
+
+    param: text: board description
+    """
+
+    try:
+        width, height, mines = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("custom boards are given as WIDTHxHEIGHTxMINES")
+    return {"width": width, "height": height, "mines": mines}
+
+def main():
+    """
+    Runs the batch from command line arguments and prints the results.
+    """
+
+    parser = argparse.ArgumentParser(description="Play many seeded MineSweeper games with a strategy.")
+    parser.add_argument("--games", type=int, default=10000, help="games per board")
+    parser.add_argument("--difficulty", nargs="*", choices=sorted(DIFFICULTIES), default=None,
+        help="difficulty presets to play, all by default")
+    parser.add_argument("--custom", nargs="*", type=parse_custom, default=[],
+        help="custom boards as WIDTHxHEIGHTxMINES")
+    parser.add_argument("--strategy", default="random", help="strategy name or module:function")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--chunk", type=int, default=500, help="games given to a worker at once")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    args = parser.parse_args()
+
+    load_strategy(args.strategy)
+    boards = []
+    if args.difficulty is None and not args.custom:
+        args.difficulty = list(DIFFICULTIES)
+    for name in args.difficulty or []:
+        boards.append((name, DIFFICULTIES[name]))
+    for board in args.custom:
+        boards.append(("custom", board))
+
+    print("{} games per board, strategy {}, {} workers".format(args.games, args.strategy, args.workers))
+    with Pool(args.workers) as pool:
+        for name, board in boards:
+            results = run_batch(pool, board, args.games, args.strategy, args.seed, args.chunk)
+            print("{:>7} {:>11}: win rate {:6.2%}, mean reveals {:6.1f}, {:8.0f} games/s".format(
+                name,
+                "{}x{}/{}".format(board["width"], board["height"], board["mines"]),
+                results["win_rate"],
+                results["mean_reveals"],
+                results["games_per_second"]
+            ))
+
+if __name__ == "__main__":
+    main()
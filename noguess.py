@@ -0,0 +1,169 @@
+"""
+noguess - boards that can be solved without guessing
+
+A board is made guess-free by trying seeds until the hint engine can play it
+to a win from its start square with certain moves only: opening squares it
+knows are safe and flagging squares it knows are mines. The start square and
+the squares around it are kept free of mines (see sweeperengine.Game), and
+opened first. A board is kept as its seed and start square, and the same
+Game is made again from them.
+
+Checking candidates with the solver takes too long to do when a game is
+started, so boards for the difficulty presets are made ahead of time by a
+pool of worker processes, QUEUE_SIZE at most for each preset. fill is called
+from the menu, and the workers make boards while the player is choosing.
+take returns a ready board, or None instead of waiting when there isn't one.
+The pool, and the modules it needs, are only loaded when guess-free boards
+are first asked for, so they don't slow down starting the game. Its workers
+start fresh ("spawn") instead of copying the game process and its window.
+"""
+
+import os
+import random
+from collections import deque
+from sweeperengine import Game, DIFFICULTIES
+from solver import Solver
+
+"""
+Boards kept ready for each difficulty preset.
+"""
+QUEUE_SIZE = 3
+
+"""
+Seeds tried for one board before giving up. Guess-free boards become rare as the mines get denser.
+"""
+MAX_ATTEMPTS = 2000
+
+"""
+The worker pool, boards ready for each preset, and the boards being made for each preset.
+"""
+pool = {
+    "executor": None,
+    "ready": {difficulty: deque() for difficulty in DIFFICULTIES},
+    "pending": {difficulty: [] for difficulty in DIFFICULTIES}
+}
+
+def solvable(game, row, column):
+    """
+    Plays a game from the given start square with certain moves only,
+    and returns True if that wins it. The game is played to its end.
+
+    param: game: sweeperengine.Game to play, unopened
+    param: row, column: start square
+    """
+
+    game.reveal(row, column)
+    game.pop_changes()
+    solver = Solver(game)
+    while game.current_status == "In progress":
+        hint = solver.hint()
+        if hint is None:
+            break
+        kind, hint_row, hint_column, probability = hint
+        if kind == "mine":
+            game.flag(hint_row, hint_column)
+        elif probability == 0:
+            game.reveal(hint_row, hint_column)
+        else:
+            return False
+        solver.update(game.pop_changes())
+    return game.current_status == "You won!"
+
+def generate(width, height, mines, seed):
+    """
+    Finds a guess-free board. Returns its seed and start square as (seed, row, column),
+    or None if no board was found in MAX_ATTEMPTS tries.
+    Run in the worker processes.
+
+    param: width, height, mines: board parameters
+    param: seed: seed for choosing the seeds and start squares tried
+    """
+
+    generator = random.Random(seed)
+    for _ in range(MAX_ATTEMPTS):
+        board_seed = generator.randrange(2**32)
+        row = generator.randrange(height)
+        column = generator.randrange(width)
+        if solvable(Game(width, height, mines, board_seed, start=(row, column)), row, column):
+            return board_seed, row, column
+    return None
+
+def start_pool(workers=None):
+    """
+    Starts the worker pool if it isn't running.
+
+    param: workers: number of worker processes, all cores but one by default
+    """
+
+    if pool["executor"] is None:
+        import concurrent.futures
+        import multiprocessing
+        if workers is None:
+            workers = max((os.cpu_count() or 1) - 1, 1)
+        pool["executor"] = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+def collect(difficulty):
+    """
+    Moves the finished boards of a preset to its ready boards.
+
+    param: difficulty: name of the preset
+    """
+
+    pending = []
+    for future in pool["pending"][difficulty]:
+        if not future.done():
+            pending.append(future)
+        elif not future.cancelled() and future.exception() is None and future.result() is not None:
+            pool["ready"][difficulty].append(future.result())
+    pool["pending"][difficulty] = pending
+
+def fill():
+    """
+    Starts making boards for every preset that has fewer than QUEUE_SIZE ready or being made.
+    Returns right away, the boards are made in the background.
+    """
+
+    start_pool()
+    for difficulty, board in DIFFICULTIES.items():
+        collect(difficulty)
+        while len(pool["ready"][difficulty]) + len(pool["pending"][difficulty]) < QUEUE_SIZE:
+            pool["pending"][difficulty].append(pool["executor"].submit(
+                generate, board["width"], board["height"], board["mines"], random.randrange(2**32)
+            ))
+
+def ready():
+    """
+    Returns the number of boards ready for each preset, as a dictionary.
+    """
+
+    counts = {}
+    for difficulty in DIFFICULTIES:
+        collect(difficulty)
+        counts[difficulty] = len(pool["ready"][difficulty])
+    return counts
+
+def take(difficulty):
+    """
+    Returns a ready guess-free board of a preset as (seed, row, column), or None if there isn't one,
+    and starts making another.
+
+    param: difficulty: name of the preset
+    """
+
+    collect(difficulty)
+    board = pool["ready"][difficulty].popleft() if pool["ready"][difficulty] else None
+    fill()
+    return board
+
+def shutdown():
+    """
+    Stops the worker pool, dropping the boards being made.
+    """
+
+    if pool["executor"] is not None:
+        pool["executor"].shutdown(wait=False, cancel_futures=True)
+        pool["executor"] = None
+        for difficulty in DIFFICULTIES:
+            pool["pending"][difficulty] = []
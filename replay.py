@@ -0,0 +1,289 @@
+"""
+Replay recording and verification for MineSweeper.
+
+A replay holds everything needed to play a game again: the seed and board
+parameters, the start square kept free of mines, every check_square action with the game clock at the time, and
+how the game ended. Replays are packed as variable-length integers (varints,
+7 bits per byte), so a typical game takes some tens of bytes:
+
+magic                  b"MSR2"
+seed                   zigzag varint, seeds may be negative
+width, height, mines   varints
+start                  varint, 0 for none, otherwise row*width + column + 1
+actions                varint count, then for each action the milliseconds
+                       since the previous one, row, column and button
+outcome                varint, index to OUTCOMES
+duration               varint, milliseconds on the game clock at the end
+revealed               varint, number of opened squares at the end
+
+Replays saved before start squares (magic b"MSR1") have no start field, and
+are still read.
+
+Verifying a replay plays its actions through sweeperengine.Game headlessly,
+and checks that the game ends the same way with as many squares opened, and
+that the recorded duration isn't shorter than the time of the last action.
+Used for regression testing changes to the game logic, and for checking the
+times of recorded games.
+
+Usage: python replay.py FILE [FILE ...] [--workers 4]
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+from sweeperengine import Game, REVEALED
+
+MAGIC = b"MSR2"
+OLD_MAGIC = b"MSR1"
+
+"""
+Game statuses stored in a replay, by their index.
+"""
+OUTCOMES = ["In progress", "You won!", "You lost!"]
+
+"""
+Folder where minesweeper.py saves its replays.
+"""
+REPLAY_FOLDER = "replays"
+
+def write_varint(out, value):
+    """
+    Appends a non-negative integer to a bytearray as a varint:
+    7 bits per byte, lowest bits first, the high bit set on every byte but the last.
+
+    param: out: bytearray to append to
+    param: value: integer to write
+    """
+
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data, position):
+    """
+    Reads a varint written by write_varint.
+    Returns the integer and the position after it.
+
+    param: data: bytes to read from
+    param: position: index of the first byte of the varint
+    """
+
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+def new_recording(game):
+    """
+    Starts recording a game. Returns the recording as a dictionary,
+    actions are added to it with record_action.
+
+    param: game: sweeperengine.Game about to be played
+    """
+
+    return {
+        "seed": game.seed,
+        "width": game.width,
+        "height": game.height,
+        "mines": game.mines,
+        "start": game.start,
+        "actions": []
+    }
+
+def record_action(recording, elapsed_time, row, column, button):
+    """
+    Adds one check_square action to a recording.
+
+    param: recording: recording made with new_recording
+    param: elapsed_time: game clock at the time of the action, in seconds
+    param: row, column, button: arguments given to check_square
+    """
+
+    recording["actions"].append((round(elapsed_time * 1000), row, column, button))
+
+def encode(recording, game):
+    """
+    Packs a recording and the end result of its game into bytes, see the module documentation.
+
+    param: recording: recording made with new_recording
+    param: game: the recorded game, after it has ended
+    """
+
+    out = bytearray(MAGIC)
+    write_varint(out, recording["seed"] * 2 if recording["seed"] >= 0 else -recording["seed"] * 2 - 1)
+    write_varint(out, recording["width"])
+    write_varint(out, recording["height"])
+    write_varint(out, recording["mines"])
+    start = recording["start"]
+    write_varint(out, 0 if start is None else start[0]*recording["width"] + start[1] + 1)
+    write_varint(out, len(recording["actions"]))
+    previous = 0
+    for milliseconds, row, column, button in recording["actions"]:
+        write_varint(out, milliseconds - previous)
+        write_varint(out, row)
+        write_varint(out, column)
+        write_varint(out, button)
+        previous = milliseconds
+    write_varint(out, OUTCOMES.index(game.current_status))
+    write_varint(out, max(round(game.elapsed_time * 1000), previous))
+    write_varint(out, sum(1 for square in game.field if square & REVEALED))
+    return bytes(out)
+
+def decode(data):
+    """
+    Unpacks a replay made with encode into a dictionary with seed, width, height, mines,
+    start, actions (as in new_recording), outcome, duration (in milliseconds) and revealed.
+    Raises ValueError if the data isn't a replay.
+
+    param: data: packed replay
+    """
+
+    if data[:len(MAGIC)] not in (MAGIC, OLD_MAGIC):
+        raise ValueError("Not a replay")
+    try:
+        position = len(MAGIC)
+        values = []
+        for _ in range(6 if data[:len(MAGIC)] == MAGIC else 5):
+            value, position = read_varint(data, position)
+            values.append(value)
+        if len(values) == 5:
+            values.insert(4, 0)
+        seed, width, height, mines, start, count = values
+        actions = []
+        milliseconds = 0
+        for _ in range(count):
+            delta, position = read_varint(data, position)
+            row, position = read_varint(data, position)
+            column, position = read_varint(data, position)
+            button, position = read_varint(data, position)
+            milliseconds += delta
+            actions.append((milliseconds, row, column, button))
+        outcome, position = read_varint(data, position)
+        duration, position = read_varint(data, position)
+        revealed, position = read_varint(data, position)
+    except IndexError:
+        raise ValueError("Replay is cut short")
+
+    return {
+        "seed": seed // 2 if seed % 2 == 0 else -(seed + 1) // 2,
+        "width": width,
+        "height": height,
+        "mines": mines,
+        "start": divmod(start - 1, width) if start else None,
+        "actions": actions,
+        "outcome": OUTCOMES[outcome],
+        "duration": duration,
+        "revealed": revealed
+    }
+
+def replay(recording):
+    """
+    Plays the actions of a recording in a new game, and returns the game.
+
+    param: recording: recording as returned by decode
+    """
+
+    game = Game(recording["width"], recording["height"], recording["mines"], recording["seed"],
+        start=recording["start"])
+    for _, row, column, button in recording["actions"]:
+        game.check_square(row, column, button)
+    game.changed = []
+    return game
+
+def verify(data):
+    """
+    Checks a packed replay. Returns None if it plays the same way again,
+    otherwise a description of the difference.
+
+    param: data: packed replay
+    """
+
+    try:
+        recording = decode(data)
+    except ValueError as error:
+        return str(error)
+    actions = recording["actions"]
+    if actions and actions[-1][0] > recording["duration"]:
+        return "duration {} ms is shorter than the last action at {} ms".format(recording["duration"], actions[-1][0])
+    try:
+        game = replay(recording)
+    except (ValueError, IndexError) as error:
+        return "invalid game: {}".format(error)
+    if game.current_status != recording["outcome"]:
+        return "ended as {!r} instead of {!r}".format(game.current_status, recording["outcome"])
+    revealed = sum(1 for square in game.field if square & REVEALED)
+    if revealed != recording["revealed"]:
+        return "{} squares opened instead of {}".format(revealed, recording["revealed"])
+    return None
+
+def save(data, folder=REPLAY_FOLDER):
+    """
+    Saves a packed replay to the replay folder, named by the current time. Returns the path.
+
+    param: data: packed replay
+    param: folder: folder to save to
+    """
+
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, datetime.now().strftime("%Y%m%d-%H%M%S-%f.msr"))
+    with open(path, "wb") as file:
+        file.write(data)
+    return path
+
+def verify_file(path):
+    """
+    Reads and verifies one replay file. Returns the path and the result of verify.
+
+    param: path: path to the replay
+    """
+
+    with open(path, "rb") as file:
+        return path, verify(file.read())
+
+def main():
+    """
+    Verifies replay files given on the command line, and prints the ones that don't match.
+    argparse and multiprocessing are imported here, as minesweeper.py imports this module
+    for recording, and shouldn't have to wait for them at start.
+    """
+
+    import argparse
+    from multiprocessing import Pool
+
+    parser = argparse.ArgumentParser(description="Verify MineSweeper replays by playing them again.")
+    parser.add_argument("files", nargs="+", help="replay files, or folders of them")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    args = parser.parse_args()
+
+    paths = []
+    for name in args.files:
+        if os.path.isdir(name):
+            paths.extend(os.path.join(name, filename) for filename in sorted(os.listdir(name)))
+        else:
+            paths.append(name)
+
+    start = time.perf_counter()
+    if args.workers > 1:
+        with Pool(args.workers) as pool:
+            results = list(pool.imap_unordered(verify_file, paths, chunksize=64))
+    else:
+        results = [verify_file(path) for path in paths]
+    duration = time.perf_counter() - start
+
+    failed = 0
+    for path, problem in results:
+        if problem is not None:
+            failed += 1
+            print("{}: {}".format(path, problem))
+    print("{} replays, {} failed, {:.0f} replays/s".format(len(results), failed, len(results) / max(duration, 1e-9)))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,561 @@
+"""
+Game server for MineSweeper.
+
+Hosts any number of games in one process with asyncio, for playing and
+watching over TCP, e.g. tournaments on a local network. Games are played
+with sweeperengine.Game, and only the squares each action changes are sent
+to the clients, from Game.apply.
+
+Clients and the server send JSON objects, one per line. Clients send:
+
+{"type": "new", "difficulty": "easy"}        start a game on a preset, or on
+{"type": "new", "width": 30, "height": 16,   a custom board, seed optional
+ "mines": 99, "seed": 1}
+{"type": "action", "game": 1, "row": 0,      act in an own game, buttons as in
+ "column": 0, "button": 1}                   Game.check_square
+{"type": "watch", "game": 1}                 start or stop spectating a game
+{"type": "unwatch", "game": 1}
+{"type": "list"}                             list the games being hosted
+
+The server sends:
+
+{"type": "game", "game": 1, "width": 9,      a game was started
+ "height": 9, "mines": 10, "seed": 1}
+{"type": "changes", "game": 1, "cells":      squares changed by an action as
+ [[row, column, shown], ...], "status":      [row, column, shown], shown as in
+ "In progress", "mines_flagged": 0,          Game.shown_square, and the status
+ "elapsed_time": 1.5}                        after it
+{"type": "time", "game": 1,                  the clock of a game went past a
+ "elapsed_time": 2}                          whole second
+{"type": "games", "games": [[1, "You won!"]]}
+{"type": "closed", "game": 1}                the game ended, or its player left
+                                             or started another one
+{"type": "error", "message": "..."}
+
+The player of a game gets its changes like spectators do, and an action
+that changes nothing is answered with no cells. A client plays one game at
+a time: starting a new game closes the previous one, and a game is closed
+once it has ended, so only games in progress are hosted and listed.
+Spectators start with a changes message of every square opened or flagged
+so far. Clocks of all games are advanced by one timer task. Messages are
+written without waiting for slow clients, and a client that lets more than
+MAX_BUFFER bytes pile up is disconnected.
+
+--load plays the given number of games with bots over localhost against a
+server in the same process, with spectators watching them, and reports the
+rate of actions and how long they took to be answered. The bots wait
+--think seconds between actions on average, starting at random times within
+the first two of those, and start a new game when one ends. The bots share the
+core with the server, so the rates are lower than those of a server alone.
+
+Usage: python server.py [--host 127.0.0.1] [--port 8765]
+       python server.py --load 1000 [--spectators 100] [--think 1] [--duration 10]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from sweeperengine import Game, DIFFICULTIES, REVEALED, FLAGGED
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+"""
+Seconds between advancing the clocks of games in progress.
+"""
+TIMER_INTERVAL = 0.1
+
+"""
+Most bytes a client may have waiting to be sent to it before it is disconnected.
+"""
+MAX_BUFFER = 1 << 20
+
+"""
+Connections waiting to be accepted at most. A tournament's players may all connect at once,
+and connections over the limit are retried by their clients only after a second or more.
+"""
+BACKLOG = 4096
+
+"""
+Largest board a client may start, in squares. Games are made and played on the event loop,
+so this keeps any one client's board from holding up every other game.
+"""
+MAX_SQUARES = 100*100
+
+class HostedGame:
+    """
+    A game hosted by the server, with the connection playing it and those watching it.
+
+    param: game: sweeperengine.Game being played
+    param: player: stream writer of the player's connection
+    """
+
+    __slots__ = ("game", "player", "watchers", "second")
+
+    def __init__(self, game, player):
+        self.game = game
+        self.player = player
+        self.watchers = {player}
+        self.second = 0
+
+class GameServer:
+    """
+    Hosts games for clients connected over TCP, see the module documentation for the protocol.
+    """
+
+    def __init__(self):
+        self.games = {}
+        self.running = set()
+        self.next_id = 1
+        self.clients = 0
+        self.timer = None
+
+    async def start(self, host=HOST, port=PORT):
+        """
+        Starts listening for clients and the timer task. Returns the asyncio server.
+
+        param: host: address to listen on
+        param: port: port to listen on, 0 for any free port
+        """
+
+        server = await asyncio.start_server(self.handle_client, host, port, backlog=BACKLOG)
+        self.timer = asyncio.ensure_future(self.run_timer())
+        return server
+
+    async def handle_client(self, reader, writer):
+        """
+        Reads messages from one client until it disconnects or sends a line longer than
+        the stream's limit, then closes the games it was playing and stops it watching others.
+
+        param: reader, writer: streams of the connection
+        """
+
+        self.clients += 1
+        playing = set()
+        watching = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    self.send(writer, {"type": "error", "message": "Message too long"})
+                    break
+                if not line:
+                    break
+                try:
+                    self.handle_message(json.loads(line), writer, playing, watching)
+                except KeyError as error:
+                    self.send(writer, {"type": "error", "message": "Missing or unknown {}".format(error)})
+                except (ValueError, TypeError) as error:
+                    self.send(writer, {"type": "error", "message": str(error)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for game_id in watching:
+                if game_id in self.games:
+                    self.games[game_id].watchers.discard(writer)
+            for game_id in playing:
+                self.close_game(game_id)
+            writer.close()
+            self.clients -= 1
+
+    def handle_message(self, message, writer, playing, watching):
+        """
+        Handles one message from a client.
+
+        param: message: decoded message
+        param: writer: stream writer of the client
+        param: playing: ids of the games the client plays
+        param: watching: ids of the games the client watches
+        """
+
+        if not isinstance(message, dict):
+            raise ValueError("Messages must be JSON objects")
+        kind = message["type"]
+        if kind == "new":
+            game_id = self.new_game(message, writer)
+            for previous in playing:
+                self.close_game(previous)
+            playing.clear()
+            playing.add(game_id)
+        elif kind == "action":
+            hosted = self.games[message["game"]]
+            if hosted.player is not writer:
+                raise ValueError("Not your game")
+            if self.act(message["game"], hosted, int(message["row"]), int(message["column"]), int(message["button"])):
+                playing.discard(message["game"])
+        elif kind == "watch":
+            hosted = self.games[message["game"]]
+            hosted.watchers.add(writer)
+            watching.add(message["game"])
+            self.send(writer, self.view(message["game"], hosted))
+        elif kind == "unwatch":
+            if message["game"] in self.games:
+                self.games[message["game"]].watchers.discard(writer)
+            watching.discard(message["game"])
+        elif kind == "list":
+            self.send(writer, {
+                "type": "games",
+                "games": [[game_id, hosted.game.current_status] for game_id, hosted in self.games.items()]
+            })
+        else:
+            raise ValueError("Unknown message type: {}".format(kind))
+
+    def new_game(self, message, writer):
+        """
+        Starts a game for a client, and returns its id.
+        Raises ValueError if the board isn't valid.
+
+        param: message: new game message, with a difficulty or the size of the board
+        param: writer: stream writer of the player
+        """
+
+        if "difficulty" in message:
+            board = DIFFICULTIES[message["difficulty"]]
+        else:
+            board = {key: int(message[key]) for key in ("width", "height", "mines")}
+        if board["width"] < 1 or board["height"] < 1 or board["width"]*board["height"] > MAX_SQUARES:
+            raise ValueError("Board must have between 1 and {} squares".format(MAX_SQUARES))
+        seed = message.get("seed")
+        game = Game(board["width"], board["height"], board["mines"], int(seed) if seed is not None else None)
+
+        game_id = self.next_id
+        self.next_id += 1
+        self.games[game_id] = HostedGame(game, writer)
+        self.running.add(game_id)
+        self.send(writer, {
+            "type": "game",
+            "game": game_id,
+            "width": game.width,
+            "height": game.height,
+            "mines": game.mines,
+            "seed": game.seed
+        })
+        return game_id
+
+    def act(self, game_id, hosted, row, column, button):
+        """
+        Applies a click to a game, and sends the squares it changed to everyone in the game.
+        An action that changes nothing is answered to the player only, with no cells.
+        A game that ends is closed after its last changes are sent. Returns True if it ended.
+        Raises ValueError if the square or the button isn't valid.
+
+        param: game_id: id of the game
+        param: hosted: the hosted game
+        param: row, column, button: the click, as given to Game.check_square
+        """
+
+        game = hosted.game
+        if not (0 <= row < game.height and 0 <= column < game.width):
+            raise ValueError("Square outside the field: {}, {}".format(row, column))
+        if button == 1:
+            action = "reveal"
+        elif button == 2:
+            action = "chord"
+        elif button == 4:
+            action = "unflag" if game.shown_square(row, column) == "f" else "flag"
+        else:
+            raise ValueError("Unknown button: {}".format(button))
+        changes, status = game.apply([(action, row, column)])
+        message = {
+            "type": "changes",
+            "game": game_id,
+            "cells": changes,
+            "status": status["current_status"],
+            "mines_flagged": status["mines_flagged"],
+            "elapsed_time": round(status["elapsed_time"], 1)
+        }
+        if not changes:
+            self.send(hosted.player, message)
+            return False
+        self.broadcast(hosted, message)
+        if status["current_status"] != "In progress":
+            self.close_game(game_id)
+            return True
+        return False
+
+    def view(self, game_id, hosted):
+        """
+        Returns a changes message of every square opened or flagged in a game, for a new spectator.
+
+        param: game_id: id of the game
+        param: hosted: the hosted game
+        """
+
+        game = hosted.game
+        cells = []
+        for index, square in enumerate(game.field):
+            if square & (REVEALED | FLAGGED):
+                row, column = divmod(index, game.width)
+                cells.append((row, column, game.shown_square(row, column)))
+        return {
+            "type": "changes",
+            "game": game_id,
+            "cells": cells,
+            "status": game.current_status,
+            "mines_flagged": game.mines_flagged,
+            "elapsed_time": round(game.elapsed_time, 1)
+        }
+
+    def close_game(self, game_id):
+        """
+        Stops hosting a game after it has ended or its player has left or started another,
+        and tells its spectators.
+
+        param: game_id: id of the game
+        """
+
+        hosted = self.games.pop(game_id)
+        self.running.discard(game_id)
+        hosted.watchers.discard(hosted.player)
+        self.broadcast(hosted, {"type": "closed", "game": game_id})
+
+    async def run_timer(self):
+        """
+        Advances the clocks of every game in progress, and sends their time
+        to everyone in the game as it goes past a whole second.
+        """
+
+        previous = time.perf_counter()
+        while True:
+            await asyncio.sleep(TIMER_INTERVAL)
+            now = time.perf_counter()
+            elapsed = now - previous
+            previous = now
+            for game_id in self.running:
+                hosted = self.games[game_id]
+                hosted.game.tick(elapsed)
+                second = int(hosted.game.elapsed_time)
+                if second != hosted.second:
+                    hosted.second = second
+                    self.broadcast(hosted, {"type": "time", "game": game_id, "elapsed_time": second})
+
+    def send(self, writer, message):
+        """
+        Sends one message to a client.
+
+        param: writer: stream writer of the client
+        param: message: message to send
+        """
+
+        self.write(writer, (json.dumps(message, separators=(",", ":")) + "\n").encode())
+
+    def broadcast(self, hosted, message):
+        """
+        Sends one message to the player and spectators of a game, encoding it only once.
+
+        param: hosted: the hosted game
+        param: message: message to send
+        """
+
+        data = (json.dumps(message, separators=(",", ":")) + "\n").encode()
+        for writer in list(hosted.watchers):
+            self.write(writer, data)
+
+    def write(self, writer, data):
+        """
+        Writes encoded messages to a client without waiting for it,
+        disconnecting it if it has fallen too far behind.
+
+        param: writer: stream writer of the client
+        param: data: encoded messages
+        """
+
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > MAX_BUFFER:
+            writer.close()
+            return
+        writer.write(data)
+
+async def serve(host, port):
+    """
+    Hosts games until interrupted.
+
+    param: host: address to listen on
+    param: port: port to listen on
+    """
+
+    server = await GameServer().start(host, port)
+    print("Serving on {}:{}".format(host, port))
+    async with server:
+        await server.serve_forever()
+
+async def send_message(writer, message):
+    """
+    Sends one message from a load test client.
+
+    param: writer: stream writer of the connection
+    param: message: message to send
+    """
+
+    writer.write((json.dumps(message, separators=(",", ":")) + "\n").encode())
+    await writer.drain()
+
+async def read_message(reader, kind):
+    """
+    Reads messages on a load test connection until one of the given type arrives, and returns it.
+
+    param: reader: stream reader of the connection
+    param: kind: type of the message to wait for
+    """
+
+    while True:
+        message = json.loads(await reader.readline())
+        if message["type"] == kind:
+            return message
+
+async def play_bot(port, seed, think, deadline, results, game_ids):
+    """
+    Plays games on the server until the deadline, opening random unopened squares,
+    and records how long each action took to be answered.
+
+    param: port: port of the server on localhost
+    param: seed: seed for the bot's random choices and boards
+    param: think: mean seconds to wait between actions, like a player would
+    param: deadline: event loop time to stop at
+    param: results: dictionary of counters and latencies shared by the bots
+    param: game_ids: list of the ids of games being played, for spectators
+    """
+
+    loop = asyncio.get_running_loop()
+    generator = random.Random(seed)
+    await asyncio.sleep(think*2*generator.random())
+    reader, writer = await asyncio.open_connection(HOST, port)
+    while loop.time() < deadline:
+        await send_message(writer, {"type": "new", "difficulty": "medium", "seed": generator.randrange(2**32)})
+        game = await read_message(reader, "game")
+        game_ids.append(game["game"])
+        squares = [(row, column) for row in range(game["height"]) for column in range(game["width"])]
+        generator.shuffle(squares)
+        opened = set()
+        status = "In progress"
+        while status == "In progress" and loop.time() < deadline:
+            while squares[-1] in opened:
+                squares.pop()
+            row, column = squares.pop()
+            start = time.perf_counter()
+            await send_message(writer, {"type": "action", "game": game["game"], "row": row, "column": column, "button": 1})
+            changes = await read_message(reader, "changes")
+            results["latencies"].append(time.perf_counter() - start)
+            results["actions"] += 1
+            opened.update((changed_row, changed_column) for changed_row, changed_column, _ in changes["cells"])
+            status = changes["status"]
+            await asyncio.sleep(think*2*generator.random())
+        results["games"] += status != "In progress"
+        game_ids.remove(game["game"])
+    writer.close()
+
+async def watch_bot(port, seed, deadline, results, game_ids):
+    """
+    Watches random games being played until the deadline, moving to another one when a game is closed,
+    and counts the messages received.
+
+    param: port: port of the server on localhost
+    param: seed: seed for choosing games
+    param: deadline: event loop time to stop at
+    param: results: dictionary of counters shared by the bots
+    param: game_ids: list of the ids of games being played
+    """
+
+    loop = asyncio.get_running_loop()
+    generator = random.Random(seed)
+    reader, writer = await asyncio.open_connection(HOST, port)
+    watched = None
+    while loop.time() < deadline:
+        if watched is None:
+            if not game_ids:
+                await asyncio.sleep(TIMER_INTERVAL)
+                continue
+            watched = generator.choice(game_ids)
+            await send_message(writer, {"type": "watch", "game": watched})
+        try:
+            line = await asyncio.wait_for(reader.readline(), deadline - loop.time())
+        except asyncio.TimeoutError:
+            break
+        message = json.loads(line)
+        results["watched"] += 1
+        if message.get("game", watched) != watched:
+            continue
+        if message["type"] in ("closed", "error") or message.get("status", "In progress") != "In progress":
+            if message["type"] != "error":
+                await send_message(writer, {"type": "unwatch", "game": watched})
+            watched = None
+    writer.close()
+
+async def load_test(players, spectators, think, duration):
+    """
+    Runs a server on localhost with bots playing and watching games on it for the given time,
+    and returns the results as a dictionary.
+
+    param: players: number of games played at once
+    param: spectators: number of spectator connections
+    param: think: mean seconds the players wait between actions
+    param: duration: seconds to play for
+    """
+
+    game_server = GameServer()
+    server = await game_server.start(HOST, 0)
+    port = server.sockets[0].getsockname()[1]
+    results = {"actions": 0, "games": 0, "watched": 0, "latencies": []}
+    game_ids = []
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    deadline = start + duration
+    bots = [play_bot(port, seed, think, deadline, results, game_ids) for seed in range(players)]
+    bots += [watch_bot(port, seed, deadline, results, game_ids) for seed in range(spectators)]
+    await asyncio.gather(*bots)
+    elapsed = loop.time() - start
+    while game_server.clients:
+        await asyncio.sleep(TIMER_INTERVAL)
+
+    game_server.timer.cancel()
+    server.close()
+    await server.wait_closed()
+    latencies = sorted(results["latencies"])
+    return {
+        "games": results["games"],
+        "actions": results["actions"],
+        "actions_per_second": results["actions"] / elapsed,
+        "watched_per_second": results["watched"] / elapsed,
+        "median_latency": statistics.median(latencies) if latencies else 0,
+        "p99_latency": latencies[int(len(latencies)*0.99)] if latencies else 0
+    }
+
+def main():
+    """
+    Runs the server, or the load test, from command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description="Host MineSweeper games over TCP.")
+    parser.add_argument("--host", default=HOST, help="address to listen on")
+    parser.add_argument("--port", type=int, default=PORT, help="port to listen on")
+    parser.add_argument("--load", type=int, metavar="GAMES",
+        help="play this many games at once with bots on localhost, and report the results")
+    parser.add_argument("--spectators", type=int, default=0, help="spectators watching the load test")
+    parser.add_argument("--think", type=float, default=1,
+        help="mean seconds the load test players wait between actions")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run the load test for")
+    args = parser.parse_args()
+
+    if args.load:
+        results = asyncio.run(load_test(args.load, args.spectators, args.think, args.duration))
+        print("{} games at once, {} spectators: {} actions, {:.0f} actions/s, {} games finished".format(
+            args.load, args.spectators, results["actions"], results["actions_per_second"], results["games"]
+        ))
+        print("latency median {:.1f} ms, 99th percentile {:.1f} ms, {:.0f} messages/s to spectators".format(
+            results["median_latency"]*1000, results["p99_latency"]*1000, results["watched_per_second"]
+        ))
+        return
+
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+snapshot - saving and continuing games of MineSweeper
+
+A game in progress is saved into one compact file: a fixed size header, the
+seed, and three bitmaps of the field, one bit per square, for mines, opened
+squares and flags. A 1000x1000 game takes about 375 kB.
+
+header     struct HEADER: magic b"MSS1", width, height, mines, elapsed time,
+           length of the seed and name of the difficulty
+seed       seed of the game as decimal digits, seeds can be of any size
+bitmaps    mines, opened squares and flags, (width*height + 7) // 8 bytes
+           each, square by square row by row, lowest bit first
+
+The file is memory mapped when loaded, and the bitmaps are expanded into the
+game's field with bytes and integer operations that run in C: each bitmap
+becomes one large integer with a byte for each square, and the numbers of
+surrounding mines are counted by adding shifted copies of the mine integer.
+No Python code runs for each square, so continuing even a large game takes
+only a moment.
+"""
+
+import mmap
+import os
+import struct
+from sweeperengine import Game, MINE, REVEALED, FLAGGED
+
+HEADER = struct.Struct("<4sIIIdI16s")
+MAGIC = b"MSS1"
+
+"""
+File where minesweeper.py saves a game it is quit in the middle of.
+"""
+SAVE_FILE = "save.mss"
+
+def pack_bits(field, bit):
+    """
+    Packs one bit flag of every square in a field into a bitmap.
+
+    param: field: game field, see sweeperengine.Game
+    param: bit: bit flag to pack, e.g. MINE
+    """
+
+    digits = bytes(48 + bool(value & bit) for value in range(256))
+    bits = field.translate(digits)[::-1]
+    return int(bits, 2).to_bytes((len(field) + 7) // 8, "little") if bits else b""
+
+def unpack_bits(bitmap, cells):
+    """
+    Expands a bitmap made with pack_bits into an integer with one byte for each square,
+    1 where the bit is set and 0 where it isn't, lowest square in the lowest byte.
+
+    param: bitmap: packed bitmap, bytes or memoryview
+    param: cells: number of squares
+    """
+
+    digits = format(int.from_bytes(bitmap, "little"), "b").zfill(cells)[::-1][:cells]
+    return int.from_bytes(digits.encode().translate(bytes.maketrans(b"01", b"\x00\x01")), "little")
+
+def count_neighbours(mines, width, height):
+    """
+    Counts the mines around every square at once, from an integer with one byte for each square
+    (see unpack_bits). Shifting the integer by one byte moves the mines one column,
+    by a row's worth of bytes one row, and adding the shifted copies counts them.
+    Masks keep mines from wrapping over the edges of a row. Returns the counts in the same form;
+    the count of a mine doesn't include itself, like in sweeperengine.Game.
+
+    param: mines: mines as an integer with one byte for each square
+    param: width, height: size of the field
+    """
+
+    cells = width*height
+    everything = (1 << 8*cells) - 1
+    not_first = int.from_bytes((b"\x00" + b"\xff"*(width - 1)) * height, "little")
+    not_last = int.from_bytes((b"\xff"*(width - 1) + b"\x00") * height, "little")
+    rows = mines + ((mines >> 8) & not_last) + ((mines << 8) & not_first)
+    return rows + (rows >> 8*width) + ((rows << 8*width) & everything) - mines
+
+def save(game, difficulty, path=SAVE_FILE):
+    """
+    Saves a game to a file.
+
+    param: game: sweeperengine.Game to save
+    param: difficulty: name of the difficulty, saved with the game for statistics
+    param: path: file to save to
+    """
+
+    seed = str(game.seed).encode()
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(
+            MAGIC, game.width, game.height, game.mines, game.elapsed_time, len(seed), difficulty.encode()
+        ))
+        file.write(seed)
+        for bit in (MINE, REVEALED, FLAGGED):
+            file.write(pack_bits(game.field, bit))
+
+def load(path=SAVE_FILE):
+    """
+    Loads a game saved with save. Returns the game and the name of its difficulty.
+    Raises ValueError if the file isn't a saved game.
+
+    param: path: file to load from
+    """
+
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        with memoryview(data) as view:
+            try:
+                magic, width, height, mines, elapsed_time, seed_length, difficulty = HEADER.unpack_from(view)
+            except struct.error:
+                raise ValueError("Not a saved game")
+            cells = width*height
+            size = (cells + 7) // 8
+            start = HEADER.size + seed_length
+            if magic != MAGIC or len(view) != start + 3*size:
+                raise ValueError("Not a saved game")
+            seed = int(bytes(view[HEADER.size:start]))
+            mine_bytes, revealed, flags = (
+                unpack_bits(view[start + i*size:start + (i + 1)*size], cells) for i in range(3)
+            )
+
+    field = count_neighbours(mine_bytes, width, height) + (mine_bytes << 4) + (revealed << 5) + (flags << 6)
+    game = Game(width, height, mines, seed, bytearray(field.to_bytes(cells, "little")))
+    game.elapsed_time = elapsed_time
+    return game, difficulty.rstrip(b"\x00").decode()
+
+def remove(path=SAVE_FILE):
+    """
+    Removes the saved game, if there is one.
+
+    param: path: file to remove
+    """
+
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,599 @@
+"""
+solver - hint engine for MineSweeper
+
+Works only from what the player can see: opened numbers and flags. Finds
+unopened squares that are certainly safe or certainly mines, and the
+probability of a mine in every other unopened square.
+
+The solver is kept up to date incrementally with the squares changed by each
+action (see sweeperengine.Game.pop_changes), so only numbers next to the
+changes are looked at again. Unopened squares next to numbers (the frontier)
+are split into independent components, and only components touched by the
+changes are solved again. Components are solved exactly by enumerating
+their mine arrangements, which keeps large boards from blowing up
+combinatorially as long as the components themselves stay small.
+
+"""
+
+import math
+
+"""
+What the solver knows about a square.
+"""
+UNKNOWN = 0
+FLAG = 1
+OPENED = 2
+
+"""
+Limits for solving a component exactly. Larger components, and those taking
+more than MAX_NODES steps to enumerate, get approximate probabilities from
+their numbers. With more than MAX_EXACT_COMPONENTS components, the total
+number of mines is taken into account approximately, treating components
+as independent.
+"""
+MAX_COMPONENT_SQUARES = 48
+MAX_NODES = 10000
+MAX_EXACT_COMPONENTS = 8
+
+class ComponentTooLarge(Exception):
+    """
+    Raised when enumerating a component takes too many steps.
+    """
+
+class Solver:
+    """
+    Hint engine for one game.
+
+    param: game: sweeperengine.Game (or anything with width, height, mines and shown_square) to solve
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.width = game.width
+        self.height = game.height
+        self.state = bytearray(game.width*game.height)
+        self.unknown = game.width*game.height
+        self.flags = 0
+        self.constraints = {}
+        self.square_constraints = {}
+        self.safe = set()
+        self.mines = set()
+        self.components = {}
+        self.component_of = {}
+        self.next_component = 0
+        self.dirty = set()
+        self.probabilities = {}
+        self.free_probability = 0
+        self.stale = True
+
+        self.update(
+            (row, column)
+            for row in range(self.height)
+            for column in range(self.width)
+            if game.shown_square(row, column) != " "
+        )
+
+    def neighbours(self, index):
+        """
+        Returns the linear indices of the squares around the given one.
+
+        param: index: linear index of the square
+        """
+
+        y, x = divmod(index, self.width)
+        return [
+            i*self.width + j
+            for i in range(max(y-1, 0), min(y+2, self.height))
+            for j in range(max(x-1, 0), min(x+2, self.width))
+            if i != y or j != x
+        ]
+
+    def update(self, changes):
+        """
+        Updates the solver after squares have changed in the game.
+        Only numbers next to the changed squares are read again.
+
+        param: changes: (row, column) positions of changed squares
+        """
+
+        affected = set()
+        for row, column in changes:
+            index = row*self.width + column
+            shown = self.game.shown_square(row, column)
+            if shown == " ":
+                new = UNKNOWN
+            elif shown == "f":
+                new = FLAG
+            else:
+                new = OPENED
+            old = self.state[index]
+            self.state[index] = new
+            self.unknown += (new == UNKNOWN) - (old == UNKNOWN)
+            self.flags += (new == FLAG) - (old == FLAG)
+            if new != UNKNOWN:
+                self.safe.discard(index)
+                self.mines.discard(index)
+            affected.add(index)
+            affected.update(self.neighbours(index))
+
+        queue = [index for index in affected if self.set_constraint(index)]
+        self.propagate(queue)
+        self.stale = True
+
+    def set_constraint(self, index):
+        """
+        Rebuilds the constraint of the given square: the unknown squares around
+        an opened number, and how many mines are still missing from them.
+        Returns True if the square has a constraint.
+
+        param: index: linear index of the square
+        """
+
+        old = self.constraints.pop(index, None)
+        if old is not None:
+            for square in old[0]:
+                self.forget_constraint(square, index)
+
+        if self.state[index] != OPENED:
+            return False
+        number = self.game.shown_square(*divmod(index, self.width))
+        if number == "x":
+            return False
+
+        squares = set()
+        remaining = number
+        for square in self.neighbours(index):
+            if self.state[square] == FLAG or square in self.mines:
+                remaining -= 1
+            elif self.state[square] == UNKNOWN and square not in self.safe:
+                squares.add(square)
+        if not squares:
+            return False
+
+        self.constraints[index] = [squares, remaining]
+        for square in squares:
+            self.square_constraints.setdefault(square, set()).add(index)
+            self.dirty.add(square)
+        return True
+
+    def forget_constraint(self, square, index):
+        """
+        Removes the given constraint from a square.
+
+        param: square: linear index of the square
+        param: index: linear index of the number the constraint belongs to
+        """
+
+        constraints = self.square_constraints.get(square)
+        if constraints is not None:
+            constraints.discard(index)
+            if not constraints:
+                del self.square_constraints[square]
+        self.dirty.add(square)
+
+    def resolve(self, square, mine, queue):
+        """
+        Marks a square as certainly a mine or certainly safe,
+        and removes it from the constraints it appears in.
+
+        param: square: linear index of the square
+        param: mine: True for a mine, False for a safe square
+        param: queue: list where changed constraints are added
+        """
+
+        if mine:
+            self.mines.add(square)
+        else:
+            self.safe.add(square)
+        self.dirty.add(square)
+        for index in self.square_constraints.pop(square, ()):
+            constraint = self.constraints[index]
+            constraint[0].discard(square)
+            if mine:
+                constraint[1] -= 1
+            queue.append(index)
+
+    def propagate(self, queue):
+        """
+        Applies the simple rules to the queued constraints until nothing changes:
+        if no mines are missing, all squares are safe, and if as many mines
+        are missing as there are squares, all of them are mines.
+
+        param: queue: list of linear indices of constraints to check
+        """
+
+        while queue:
+            index = queue.pop()
+            constraint = self.constraints.get(index)
+            if constraint is None:
+                continue
+            squares, remaining = constraint
+            if not squares:
+                del self.constraints[index]
+            elif remaining == 0 or remaining == len(squares):
+                for square in list(squares):
+                    self.resolve(square, remaining > 0, queue)
+
+    def solve(self):
+        """
+        Solves the components changed since the last call, and updates probabilities.
+        Called automatically by the query methods.
+        """
+
+        if not self.stale:
+            return
+        while True:
+            certain = self.solve_components()
+            certain.extend(self.combine())
+            if not certain:
+                break
+            queue = []
+            for square, mine in certain:
+                if square not in self.safe and square not in self.mines:
+                    self.resolve(square, mine, queue)
+            if not queue:
+                break
+            self.propagate(queue)
+        self.stale = False
+
+    def solve_components(self):
+        """
+        Splits the changed part of the frontier into independent components and solves them.
+        Returns a list of (square, mine) for squares found to be certain.
+        """
+
+        dirty = set()
+        for square in self.dirty:
+            component = self.components.pop(self.component_of.get(square), None)
+            if component is not None:
+                dirty.update(component["squares"])
+            dirty.add(square)
+        self.dirty = set()
+        for square in dirty:
+            self.component_of.pop(square, None)
+
+        certain = []
+        for square in dirty:
+            if square in self.component_of or square not in self.square_constraints:
+                continue
+            squares, constraints = self.collect_component(square)
+            component = self.enumerate_component(squares, constraints)
+            self.components[self.next_component] = component
+            for member in squares:
+                self.component_of[member] = self.next_component
+            self.next_component += 1
+            if not component["approximate"]:
+                total = sum(component["distribution"].values())
+                for member, counts in zip(squares, component["counts"]):
+                    mine_count = sum(counts.values())
+                    if mine_count == 0:
+                        certain.append((member, False))
+                    elif mine_count == total:
+                        certain.append((member, True))
+
+        return certain
+
+    def collect_component(self, square):
+        """
+        Finds the frontier squares and constraints connected to the given square.
+        Squares are returned in breadth first order, which keeps enumeration tight.
+
+        param: square: linear index of a frontier square
+        """
+
+        squares = [square]
+        seen = {square}
+        constraints = set()
+        for current in squares:
+            for index in self.square_constraints[current]:
+                if index not in constraints:
+                    constraints.add(index)
+                    for other in self.constraints[index][0]:
+                        if other not in seen:
+                            seen.add(other)
+                            squares.append(other)
+
+        return squares, list(constraints)
+
+    def enumerate_component(self, squares, constraints):
+        """
+        Counts the mine arrangements of a component that satisfy its constraints.
+        Returns a dictionary with the number of arrangements for each mine count
+        ("distribution"), and for each square the number of arrangements with
+        a mine in it, for each mine count ("counts").
+        Too large components are approximated instead.
+
+        param: squares: linear indices of the squares in the component
+        param: constraints: linear indices of the constraints of the component
+        """
+
+        if len(squares) > MAX_COMPONENT_SQUARES:
+            return self.approximate_component(squares)
+
+        position = {square: i for i, square in enumerate(squares)}
+        needed = []
+        left = []
+        square_constraints = [[] for _ in squares]
+        for i, index in enumerate(constraints):
+            members, remaining = self.constraints[index]
+            needed.append(remaining)
+            left.append(len(members))
+            for member in members:
+                square_constraints[position[member]].append(i)
+
+        distribution = {}
+        counts = [{} for _ in squares]
+        assignment = [0] * len(squares)
+        nodes = [0]
+
+        def step(i, mines):
+            if i == len(squares):
+                distribution[mines] = distribution.get(mines, 0) + 1
+                for j, value in enumerate(assignment):
+                    if value:
+                        counts[j][mines] = counts[j].get(mines, 0) + 1
+                return
+            nodes[0] += 1
+            if nodes[0] > MAX_NODES:
+                raise ComponentTooLarge
+            for value in (0, 1):
+                valid = True
+                for constraint in square_constraints[i]:
+                    needed[constraint] -= value
+                    left[constraint] -= 1
+                    if needed[constraint] < 0 or needed[constraint] > left[constraint]:
+                        valid = False
+                if valid:
+                    assignment[i] = value
+                    step(i + 1, mines + value)
+                for constraint in square_constraints[i]:
+                    needed[constraint] += value
+                    left[constraint] += 1
+            assignment[i] = 0
+
+        try:
+            step(0, 0)
+        except ComponentTooLarge:
+            return self.approximate_component(squares)
+        if not distribution:
+            return self.approximate_component(squares)
+
+        return {
+            "squares": squares,
+            "distribution": distribution,
+            "counts": counts,
+            "approximate": False
+        }
+
+    def approximate_component(self, squares):
+        """
+        Gives each square of a component the average density of mines missing from its numbers.
+        Used when a component is too large to enumerate, or its flags contradict the numbers.
+
+        param: squares: linear indices of the squares in the component
+        """
+
+        probabilities = []
+        for square in squares:
+            densities = [
+                min(max(self.constraints[index][1] / len(self.constraints[index][0]), 0), 1)
+                for index in self.square_constraints[square]
+            ]
+            probabilities.append(sum(densities) / len(densities))
+
+        return {
+            "squares": squares,
+            "probabilities": probabilities,
+            "approximate": True
+        }
+
+    def combine(self):
+        """
+        Combines the components with the number of mines left on the board,
+        and stores the probability of a mine for every frontier square,
+        and for squares not next to any number (free_probability).
+        Returns a list of (square, mine) for squares that turned out certain.
+        """
+
+        exact = []
+        expected = 0
+        self.probabilities = {}
+        for component in self.components.values():
+            if component["approximate"]:
+                for square, probability in zip(component["squares"], component["probabilities"]):
+                    self.probabilities[square] = probability
+                    expected += probability
+            else:
+                exact.append(component)
+
+        frontier = sum(len(component["squares"]) for component in self.components.values())
+        free = self.unknown - frontier - len(self.safe) - len(self.mines)
+        remaining = self.game.mines - self.flags - len(self.mines) - round(expected)
+
+        if len(exact) > MAX_EXACT_COMPONENTS:
+            return self.combine_independent(exact, free, remaining)
+        return self.combine_exact(exact, free, remaining)
+
+    def combine_exact(self, components, free, remaining):
+        """
+        Exact combination: every arrangement of the components is weighted by
+        the number of ways to place the rest of the mines to the free squares.
+
+        param: components: exactly solved components
+        param: free: number of unknown squares not next to any number
+        param: remaining: number of mines left for the components and free squares
+        """
+
+        log_weights = {}
+        for mines in range(0, min(remaining, free) + 1):
+            log_weights[mines] = (
+                math.lgamma(free + 1) - math.lgamma(mines + 1) - math.lgamma(free - mines + 1)
+            )
+        if not log_weights:
+            return []
+        highest = max(log_weights.values())
+        weights = {mines: math.exp(value - highest) for mines, value in log_weights.items()}
+
+        def weight(mines):
+            return weights.get(remaining - mines, 0)
+
+        distributions = [
+            {mines: float(count) for mines, count in component["distribution"].items()}
+            for component in components
+        ]
+        total = convolve_all(distributions)
+        total_weight = sum(count * weight(mines) for mines, count in total.items())
+        if total_weight == 0:
+            return []
+
+        certain = []
+        for i, component in enumerate(components):
+            others = convolve_all(distributions[:i] + distributions[i+1:])
+            factors = {
+                mines: sum(count * weight(mines + other) for other, count in others.items())
+                for mines in component["distribution"]
+            }
+            possible = [mines for mines, factor in factors.items() if factor > 0]
+            for square, counts in zip(component["squares"], component["counts"]):
+                self.probabilities[square] = sum(
+                    count * factors[mines] for mines, count in counts.items()
+                ) / total_weight
+                if all(mines not in counts for mines in possible):
+                    certain.append((square, False))
+                elif all(counts.get(mines) == component["distribution"][mines] for mines in possible):
+                    certain.append((square, True))
+
+        if free:
+            self.free_probability = sum(
+                count * weight(mines) * (remaining - mines) / free
+                for mines, count in total.items()
+            ) / total_weight
+        else:
+            self.free_probability = 0
+
+        return certain
+
+    def combine_independent(self, components, free, remaining):
+        """
+        Approximate combination for boards with many components: each component is
+        weighted by the odds of a mine given by the overall density, independently
+        of the others.
+
+        param: components: exactly solved components
+        param: free: number of unknown squares not next to any number
+        param: remaining: number of mines left for the components and free squares
+        """
+
+        squares = free + sum(len(component["squares"]) for component in components)
+        density = min(max(remaining / squares, 0), 1) if squares else 0
+        if density in (0, 1):
+            odds = density
+        else:
+            odds = density / (1 - density)
+
+        expected = 0
+        for component in components:
+            weights = {mines: count * odds**mines for mines, count in component["distribution"].items()}
+            total_weight = sum(weights.values())
+            if total_weight == 0:
+                weights = {mines: float(count) for mines, count in component["distribution"].items()}
+                total_weight = sum(weights.values())
+            expected += sum(mines * value for mines, value in weights.items()) / total_weight
+            for square, counts in zip(component["squares"], component["counts"]):
+                self.probabilities[square] = sum(
+                    count * odds**mines if odds else count * (mines == 0)
+                    for mines, count in counts.items()
+                ) / total_weight
+
+        self.free_probability = min(max((remaining - expected) / free, 0), 1) if free else 0
+        return []
+
+    def safe_squares(self):
+        """
+        Returns the (row, column) positions of unopened squares that are certainly safe.
+        """
+
+        self.solve()
+        return sorted(divmod(square, self.width) for square in self.safe)
+
+    def mine_squares(self):
+        """
+        Returns the (row, column) positions of unflagged squares that are certainly mines.
+        """
+
+        self.solve()
+        return sorted(divmod(square, self.width) for square in self.mines)
+
+    def probability(self, row, column):
+        """
+        Returns the probability of a mine in the given square.
+        Opened squares give 0 and flagged squares 1.
+
+        param: row: row position of square
+        param: column: column position of square
+        """
+
+        self.solve()
+        index = row*self.width + column
+        if self.state[index] == OPENED or index in self.safe:
+            return 0
+        if self.state[index] == FLAG or index in self.mines:
+            return 1
+        return self.probabilities.get(index, self.free_probability)
+
+    def frontier_probabilities(self):
+        """
+        Returns a dictionary of mine probabilities for the unopened squares next to numbers,
+        keyed by (row, column). Squares not next to any number have free_probability.
+        """
+
+        self.solve()
+        return {divmod(square, self.width): value for square, value in self.probabilities.items()}
+
+    def hint(self):
+        """
+        Returns the best next move as (kind, row, column, probability), where kind is
+        "safe" for a certainly safe square, "mine" for a certain mine to flag,
+        or "guess" for the unopened square least likely to be a mine.
+        Returns None if there are no unopened squares left.
+        """
+
+        self.solve()
+        if self.safe:
+            square = min(self.safe)
+            return ("safe",) + divmod(square, self.width) + (0,)
+        if self.mines:
+            square = min(self.mines)
+            return ("mine",) + divmod(square, self.width) + (1,)
+
+        best = None
+        if self.probabilities:
+            square = min(self.probabilities, key=self.probabilities.get)
+            best = (self.probabilities[square], square)
+        if self.unknown > len(self.probabilities) and (best is None or self.free_probability < best[0]):
+            for square, state in enumerate(self.state):
+                if state == UNKNOWN and square not in self.probabilities:
+                    best = (self.free_probability, square)
+                    break
+        if best is None:
+            return None
+
+        probability, square = best
+        kind = "mine" if probability >= 1 else "guess"
+        return (kind,) + divmod(square, self.width) + (probability,)
+
+def convolve_all(distributions):
+    """
+    Convolves mine count distributions (dictionaries of mine count to weight) together.
+
+    param: distributions: list of distributions
+    """
+
+    total = {0: 1.0}
+    for distribution in distributions:
+        combined = {}
+        for mines, count in total.items():
+            for other, other_count in distribution.items():
+                combined[mines + other] = combined.get(mines + other, 0) + count * other_count
+        total = combined
+    return total
@@ -0,0 +1,276 @@
+"""
+statsdb - statistics storage for MineSweeper
+
+Statistics of played games are kept in an SQLite database, with typed columns
+and indexes by difficulty and date, so they can be queried without reading
+everything. Statistics saved by older versions to stats.txt (one Python
+dictionary per line) are moved into the database once, the first time it is
+opened, after which stats.txt is renamed to stats.txt.migrated.
+
+Aggregates shown on the stats screen are kept up to date as games are saved,
+in the same transaction: a summary row per difficulty (games, wins, best time
+and current streak), and a histogram of winning times in whole seconds for
+the median. Reading them doesn't depend on the number of games saved. The
+full history is browsed a page at a time, by id, see history_page.
+
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+DATABASE = "stats.db"
+LEGACY_FILE = "stats.txt"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    played_at TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    mines INTEGER NOT NULL,
+    mines_flagged INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    outcome TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_by_difficulty ON games (difficulty, played_at);
+CREATE INDEX IF NOT EXISTS games_by_date ON games (played_at);
+CREATE TABLE IF NOT EXISTS summary (
+    difficulty TEXT PRIMARY KEY,
+    games INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    best_time REAL,
+    streak_outcome TEXT NOT NULL,
+    streak INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS win_times (
+    difficulty TEXT NOT NULL,
+    second INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (difficulty, second)
+) WITHOUT ROWID;
+"""
+
+"""
+Version of the schema, stored in the user_version of the database.
+Version 1 only had the games table, its aggregates are built once when opened.
+"""
+SCHEMA_VERSION = 2
+
+"""
+Outcomes stored in the database, by the game status they come from.
+"""
+OUTCOMES = {
+    "You won!": "won",
+    "You lost!": "lost",
+    "In progress": "unfinished"
+}
+
+def connect(path=DATABASE, legacy_path=LEGACY_FILE):
+    """
+    Opens the statistics database, creating it if needed,
+    and moves statistics from the legacy text file into it if one exists.
+
+    param: path: path to the database file
+    param: legacy_path: path to the old stats.txt
+    """
+
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    if connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        with connection:
+            rebuild_aggregates(connection)
+            connection.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+    if legacy_path and os.path.exists(legacy_path):
+        migrate_legacy(connection, legacy_path)
+    return connection
+
+def parse_legacy_line(line):
+    """
+    Parses one line of the old stats.txt into keyword arguments for record_game.
+    Returns None if the line can't be parsed.
+
+    param: line: dictionary written with str(), e.g.
+        {'Date and time': '01.02.2021 12:00', 'Duration': '01:05', 'Outcome': 'You won!', 'Mines flagged': '10/10'}
+    """
+
+    import ast
+
+    try:
+        values = ast.literal_eval(line)
+        played_at = datetime.strptime(values["Date and time"], "%d.%m.%Y %H:%M")
+        minutes, seconds = values["Duration"].split(":")
+        mines_flagged, mines = values["Mines flagged"].split("/")
+        return {
+            "played_at": played_at.isoformat(timespec="seconds"),
+            "difficulty": "unknown",
+            "width": None,
+            "height": None,
+            "mines": int(mines),
+            "mines_flagged": int(mines_flagged),
+            "duration": int(minutes)*60 + int(seconds),
+            "outcome": OUTCOMES.get(values["Outcome"], "unfinished")
+        }
+    except (ValueError, SyntaxError, KeyError, TypeError, AttributeError):
+        return None
+
+def migrate_legacy(connection, legacy_path):
+    """
+    Moves games from the old stats.txt to the database in one transaction,
+    and renames the file so it isn't migrated again. Returns the number of
+    games moved; lines that can't be parsed are skipped.
+
+    param: connection: open database connection
+    param: legacy_path: path to the old stats.txt
+    """
+
+    moved = 0
+    with open(legacy_path) as file, connection:
+        for line in file:
+            game = parse_legacy_line(line.strip())
+            if game is not None:
+                record_game(connection, **game)
+                moved += 1
+    os.replace(legacy_path, legacy_path + ".migrated")
+    return moved
+
+def record_game(connection, difficulty, width, height, mines, mines_flagged, duration, outcome, played_at=None):
+    """
+    Saves one played game, and updates the aggregates of its difficulty.
+    Call within a transaction (with connection:) to commit it.
+
+    param: connection: open database connection
+    param: difficulty: name of the difficulty, e.g. "easy" or "custom"
+    param: width, height, mines: board parameters
+    param: mines_flagged: number of correctly flagged mines
+    param: duration: game duration in seconds
+    param: outcome: "won", "lost" or "unfinished"
+    param: played_at: ISO timestamp of the game, now by default
+    """
+
+    if played_at is None:
+        played_at = datetime.now().isoformat(timespec="seconds")
+    connection.execute(
+        "INSERT INTO games (played_at, difficulty, width, height, mines, mines_flagged, duration, outcome) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (played_at, difficulty, width, height, mines, mines_flagged, duration, outcome)
+    )
+    update_aggregates(connection, difficulty, duration, outcome)
+
+def update_aggregates(connection, difficulty, duration, outcome):
+    """
+    Adds one game to the summary and winning time histogram of its difficulty.
+
+    param: connection: open database connection
+    param: difficulty: name of the difficulty
+    param: duration: game duration in seconds
+    param: outcome: "won", "lost" or "unfinished"
+    """
+
+    won = outcome == "won"
+    connection.execute(
+        "INSERT INTO summary (difficulty, games, wins, best_time, streak_outcome, streak) "
+        "VALUES (:difficulty, 1, :won, :best, :outcome, 1) "
+        "ON CONFLICT (difficulty) DO UPDATE SET "
+        "games = games + 1, "
+        "wins = wins + :won, "
+        "best_time = CASE WHEN :best IS NOT NULL AND (best_time IS NULL OR :best < best_time) "
+        "THEN :best ELSE best_time END, "
+        "streak = CASE WHEN streak_outcome = :outcome THEN streak + 1 ELSE 1 END, "
+        "streak_outcome = :outcome",
+        {"difficulty": difficulty, "won": int(won), "best": duration if won else None, "outcome": outcome}
+    )
+    if won:
+        connection.execute(
+            "INSERT INTO win_times (difficulty, second, count) VALUES (?, ?, 1) "
+            "ON CONFLICT (difficulty, second) DO UPDATE SET count = count + 1",
+            (difficulty, int(duration))
+        )
+
+def rebuild_aggregates(connection):
+    """
+    Builds the aggregates again from every saved game.
+    Only needed once, for databases saved before aggregates were kept.
+
+    param: connection: open database connection
+    """
+
+    connection.execute("DELETE FROM summary")
+    connection.execute("DELETE FROM win_times")
+    for game in connection.execute("SELECT difficulty, duration, outcome FROM games ORDER BY id").fetchall():
+        update_aggregates(connection, game["difficulty"], game["duration"], game["outcome"])
+
+def history_page(connection, before=None, after=None, limit=20):
+    """
+    Returns one page of the saved games, newest first.
+    Pages are found by id, so browsing deep into the history is as fast as the first page.
+    With neither before or after given, returns the latest games.
+
+    param: connection: open database connection
+    param: before: return the games saved before the game with this id
+    param: after: return the games saved after the game with this id
+    param: limit: maximum number of games
+    """
+
+    if after is not None:
+        games = connection.execute(
+            "SELECT * FROM games WHERE id > ? ORDER BY id LIMIT ?", (after, limit)
+        ).fetchall()
+        return games[::-1]
+    if before is None:
+        return connection.execute("SELECT * FROM games ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return connection.execute(
+        "SELECT * FROM games WHERE id < ? ORDER BY id DESC LIMIT ?", (before, limit)
+    ).fetchall()
+
+def median_win_time(connection, difficulty):
+    """
+    Returns the median winning time of a difficulty in whole seconds,
+    or None if no games have been won.
+    Read from the histogram of winning times, which has at most one row per second.
+
+    param: connection: open database connection
+    param: difficulty: name of the difficulty
+    """
+
+    counts = connection.execute(
+        "SELECT second, count FROM win_times WHERE difficulty = ? ORDER BY second", (difficulty,)
+    ).fetchall()
+    total = sum(count for _, count in counts)
+    if not total:
+        return None
+
+    lower = upper = None
+    seen = 0
+    for second, count in counts:
+        seen += count
+        if lower is None and seen >= (total + 1) // 2:
+            lower = second
+        if seen >= total // 2 + 1:
+            upper = second
+            break
+    return (lower + upper) / 2
+
+def summaries(connection):
+    """
+    Returns the aggregates of every difficulty played, as a list of dictionaries
+    with difficulty, games, wins, win_rate, best_time, median_time, streak_outcome and streak.
+
+    param: connection: open database connection
+    """
+
+    results = []
+    for row in connection.execute("SELECT * FROM summary ORDER BY difficulty").fetchall():
+        results.append({
+            "difficulty": row["difficulty"],
+            "games": row["games"],
+            "wins": row["wins"],
+            "win_rate": row["wins"] / row["games"],
+            "best_time": row["best_time"],
+            "median_time": median_win_time(connection, row["difficulty"]),
+            "streak_outcome": row["streak_outcome"],
+            "streak": row["streak"]
+        })
+    return results
@@ -0,0 +1,736 @@
+"""
+sweeperengine - game logic for MineSweeper
+
+The rules of the game, separated from the graphics. Nothing here imports
+pyglet or sweeperlib, so games can be created and played in any process
+(tests, servers, batch runs), and as many of them at once as needed.
+minesweeper.py uses this through its pyglet handlers.
+
+"""
+
+import random
+from collections import OrderedDict
+
+"""
+Bit layout of a square in Game.field.
+Low bits hold the number of surrounding mines, the rest are flags.
+"""
+COUNT_MASK = 0x0F
+MINE = 0x10
+REVEALED = 0x20
+FLAGGED = 0x40
+
+"""
+Difficulty presets of the new game menu.
+"""
+DIFFICULTIES = {
+    "easy": {"width": 9, "height": 9, "mines": 10},
+    "medium": {"width": 16, "height": 16, "mines": 40},
+    "hard": {"width": 30, "height": 16, "mines": 99}
+}
+
+"""
+Actions taken by Game.apply: open a square, put a flag on it, remove its flag,
+or open the squares around an opened number that has as many flags around it.
+"""
+ACTIONS = ("reveal", "flag", "unflag", "chord")
+
+class BaseGame:
+    """
+    Rules shared by Game and ChunkedGame: opening, flagging and chording squares,
+    the status and clock of the game, and applying actions.
+    Squares use the bit layout of Game.field. Subclasses store them,
+    and give access to them with square and set_flag, and open them with floodfill.
+
+    The game is won by opening every safe square or flagging every mine.
+    Both are counted as squares are opened and flagged (revealed_safe and mines_flagged),
+    so checking for a win doesn't look at the field.
+
+    param: width, height: size of the field
+    param: mines: number of mines
+    param: seed: seed for placing mines, random if not given
+    """
+
+    def __init__(self, width, height, mines, seed=None):
+        if seed is None:
+            seed = random.randrange(2**32)
+
+        self.width = width
+        self.height = height
+        self.mines = mines
+        self.seed = seed
+        self.current_status = "In progress"
+        self.mines_flagged = 0
+        self.safe_squares = width*height - mines
+        self.revealed_safe = 0
+        self.elapsed_time = 0
+        self.changed = []
+
+    def shown_square(self, row, column):
+        """
+        Returns what the player sees in the given square:
+        number of surrounding mines if opened, "x" for an opened mine,
+        "f" for a flag and " " for an unopened square.
+
+        param: row: row position of square
+        param: column: column position of square
+        """
+
+        square = self.square(row, column)
+        if square & REVEALED:
+            if square & MINE:
+                return "x"
+            return square & COUNT_MASK
+        elif square & FLAGGED:
+            return "f"
+        return " "
+
+    def count_surroundings(self, row, column):
+        """
+        Returns how many mines surrounds the given position.
+        The values are counted when the mines are placed.
+
+        param: row: row position of square
+        param: column: column position of square
+        """
+
+        return self.square(row, column) & COUNT_MASK
+
+    def check_square(self, row, column, button):
+        """
+        Checks clicked square, like a mouse click would.
+        Left button (1) reveals the square, middle button (2) chords (see chord)
+        and right button (4) toggles a flag.
+
+        param: row: row position of click
+        param: column: column position of click
+        param: button: button used in click
+        """
+
+        if button == 1:
+            self.reveal(row, column)
+        elif button == 2:
+            self.chord(row, column)
+        elif button == 4:
+            self.flag(row, column)
+
+    def apply(self, actions):
+        """
+        Applies a batch of actions in one call. Returns the squares they changed
+        as (row, column, shown) tuples, each square once with what the player sees in it now
+        (see shown_square), and the resulting status of the game (see status).
+        Changes made by the batch aren't left for pop_changes.
+        Raises ValueError if an action isn't one of ACTIONS or is outside the field,
+        before any of them are applied.
+
+        param: actions: (action, row, column) tuples, action being one of ACTIONS
+        """
+
+        actions = list(actions)
+        for action, row, column in actions:
+            if action not in ACTIONS:
+                raise ValueError("Unknown action: {}".format(action))
+            if not (0 <= row < self.height and 0 <= column < self.width):
+                raise ValueError("Square outside the field: {}, {}".format(row, column))
+
+        earlier = self.changed
+        self.changed = []
+        for action, row, column in actions:
+            if action == "reveal":
+                self.reveal(row, column)
+            elif action == "chord":
+                self.chord(row, column)
+            elif self.shown_square(row, column) == (" " if action == "flag" else "f"):
+                self.flag(row, column)
+        positions = dict.fromkeys(self.pop_changes())
+        self.changed = earlier
+        return [(row, column, self.shown_square(row, column)) for row, column in positions], self.status()
+
+    def reveal(self, row, column):
+        """
+        Opens the given square. Opening a mine loses the game,
+        and opening the last safe square wins it.
+
+        param: row: row position of square
+        param: column: column position of square
+        """
+
+        if self.current_status != "In progress":
+            return
+        square = self.square(row, column)
+        if square & MINE:
+            self.reveal_mines()
+            self.current_status = "You lost!"
+        elif not square & REVEALED:
+            self.floodfill(row, column)
+            if self.revealed_safe >= self.safe_squares:
+                self.current_status = "You won!"
+
+    def flag(self, row, column):
+        """
+        Puts a flag on the given unopened square, or removes an existing one.
+        Flagging every mine wins the game.
+
+        param: row: row position of square
+        param: column: column position of square
+        """
+
+        if self.current_status != "In progress":
+            return
+        square = self.square(row, column)
+        if not square & (REVEALED | FLAGGED):
+            self.set_flag(row, column, True)
+            if square & MINE:
+                self.mines_flagged += 1
+                if self.mines_flagged == self.mines:
+                    self.current_status = "You won!"
+        elif square & FLAGGED:
+            self.set_flag(row, column, False)
+            if square & MINE:
+                self.mines_flagged -= 1
+
+    def chord(self, row, column):
+        """
+        Opens every unflagged square around an opened number,
+        if there are as many flags around it as the number.
+        A wrongly placed flag makes this open a mine, which loses the game.
+
+        param: row: row position of square
+        param: column: column position of square
+        """
+
+        square = self.square(row, column)
+        if self.current_status != "In progress" or not square & REVEALED or square & MINE:
+            return
+        neighbours = [
+            (i, j)
+            for i in range(max(row-1, 0), min(row+2, self.height))
+            for j in range(max(column-1, 0), min(column+2, self.width))
+        ]
+        flags = sum(1 for i, j in neighbours if self.square(i, j) & FLAGGED)
+        if flags != square & COUNT_MASK:
+            return
+        for i, j in neighbours:
+            if not self.square(i, j) & (REVEALED | FLAGGED):
+                self.reveal(i, j)
+
+    def tick(self, elapsed):
+        """
+        Advances the game clock while the game is in progress.
+
+        param: elapsed: time elapsed in seconds
+        """
+
+        if self.current_status == "In progress":
+            self.elapsed_time += elapsed
+
+    def status(self):
+        """
+        Returns the current status of the game as a dictionary.
+        """
+
+        return {
+            "current_status": self.current_status,
+            "mines_flagged": self.mines_flagged,
+            "mines": self.mines,
+            "elapsed_time": self.elapsed_time
+        }
+
+class Game(BaseGame):
+    """
+    One game of minesweeper: its minefield, status and clock.
+
+    The field is one compact bytearray, one byte per square, row by row.
+    Each byte holds the number of surrounding mines in its low bits (COUNT_MASK),
+    and the MINE, REVEALED and FLAGGED bit flags.
+    The field shown to the player is read from it with shown_square.
+    Squares changed by actions are collected until taken with pop_changes,
+    or returned straight away when actions are applied in a batch with apply.
+    The rules of the game are in BaseGame.
+
+    A saved game is continued by giving its field, with counts already in it (see snapshot.py).
+
+    param: width, height: size of the field
+    param: mines: number of mines
+    param: seed: seed for placing mines, same seed gives the same field. Random if not given
+    param: field: field of a saved game to continue, instead of placing mines
+    param: start: (row, column) of a square kept free of mines along with the squares around it,
+        so opening it first opens an area. Mines are placed anywhere if not given
+    """
+
+    def __init__(self, width, height, mines, seed=None, field=None, start=None):
+        if mines < 0:
+            raise ValueError("Not enough mines!")
+        if mines > width*height:
+            raise ValueError("Too many mines!")
+
+        BaseGame.__init__(self, width, height, mines, seed)
+        self.start = start
+        self.field = bytearray(width*height)
+
+        if field is None:
+            self.insert_mines()
+        else:
+            self.field = field
+            flagged_mines = bytes(square & (MINE | FLAGGED) == MINE | FLAGGED for square in range(256))
+            self.mines_flagged = field.translate(flagged_mines).count(1)
+            revealed_safe = bytes(square & (MINE | REVEALED) == REVEALED for square in range(256))
+            self.revealed_safe = field.translate(revealed_safe).count(1)
+
+    def insert_mines(self):
+        """
+        Inserts mines to the field. Positions are chosen randomly,
+        by sampling linear square indices without replacement,
+        so the work done depends on the number of mines instead of the size of the field.
+        With a start square, the squares around it are left out of the sample.
+        """
+
+        generator = random.Random(self.seed)
+        squares = range(self.width*self.height)
+        if self.start is not None:
+            row, column = self.start
+            safe = {
+                i*self.width + j
+                for i in range(max(row-1, 0), min(row+2, self.height))
+                for j in range(max(column-1, 0), min(column+2, self.width))
+            }
+            squares = [index for index in squares if index not in safe]
+            if self.mines > len(squares):
+                raise ValueError("Too many mines for a safe start!")
+        mine_indices = generator.sample(squares, self.mines)
+        for index in mine_indices:
+            self.field[index] |= MINE
+
+        self.count_mines(mine_indices)
+
+    def count_mines(self, mine_indices):
+        """
+        Stores the number of surrounding mines for every square to the low bits of the field.
+        Done in one pass over the mines right after they have been inserted,
+        so counting doesn't need to be repeated when the field is opened.
+
+        param: mine_indices: list of linear indices of the mines
+        """
+
+        width = self.width
+        height = self.height
+        field = self.field
+        for index in mine_indices:
+            y, x = divmod(index, width)
+            for i in range(max(y-1, 0), min(y+2, height)):
+                for j in range(max(x-1, 0), min(x+2, width)):
+                    field[i*width + j] += 1
+            field[index] -= 1
+
+    def square(self, row, column):
+        """
+        Returns the given square of the field.
+
+        param: row: row position of square
+        param: column: column position of square
+        """
+
+        return self.field[row*self.width + column]
+
+    def set_flag(self, row, column, flagged):
+        """
+        Puts a flag on the given square or removes it, and marks the square changed.
+
+        param: row: row position of square
+        param: column: column position of square
+        param: flagged: True to put a flag, False to remove it
+        """
+
+        index = row*self.width + column
+        if flagged:
+            self.field[index] |= FLAGGED
+        else:
+            self.field[index] &= ~FLAGGED
+        self.changed.append(index)
+
+    def reveal_mines(self):
+        """
+        Shows all mines after losing, and removes flags.
+        """
+
+        field = self.field
+        for index, square in enumerate(field):
+            if square & MINE:
+                field[index] = (square | REVEALED) & ~FLAGGED
+                self.changed.append(index)
+            elif square & FLAGGED:
+                field[index] = square & ~FLAGGED
+                self.changed.append(index)
+
+    def floodfill(self, starting_row, starting_column):
+        """
+        Opens up playarea, minesweeper style.
+        Squares are opened as soon as they are found,
+        so each square is put on the checklist only once.
+
+        param: starting_row: row position on where to start
+        param: starting_column: column position on where to start
+        """
+
+        field = self.field
+        changed = self.changed
+        width = self.width
+        height = self.height
+        opened = len(changed)
+
+        first = starting_row*width + starting_column
+        square = field[first]
+        if square & REVEALED:
+            return
+        field[first] = (square | REVEALED) & ~FLAGGED
+        changed.append(first)
+        checklist = [] if square & COUNT_MASK else [first]
+
+        while checklist:
+            y, x = divmod(checklist.pop(), width)
+            for i in range(max(y-1, 0), min(y+2, height)):
+                for j in range(max(x-1, 0), min(x+2, width)):
+                    index = i*width + j
+                    square = field[index]
+                    if not square & REVEALED:
+                        field[index] = (square | REVEALED) & ~FLAGGED
+                        changed.append(index)
+                        if not square & COUNT_MASK:
+                            checklist.append(index)
+        self.revealed_safe += len(changed) - opened
+
+    def pop_changes(self):
+        """
+        Returns the (row, column) positions of squares changed since the last call, and forgets them.
+        """
+
+        changes = [divmod(index, self.width) for index in self.changed]
+        self.changed = []
+        return changes
+
+"""
+Size of the square chunks of a ChunkedGame, and how many chunks it keeps in memory at most,
+not counting chunks that have been partly opened.
+"""
+CHUNK_SIZE = 32
+CHUNK_CACHE_SIZE = 256
+
+class Chunk:
+    """
+    One chunk of a ChunkedGame, in memory.
+    The field uses the same bit layout as Game.field, row by row within the chunk.
+
+    param: field: squares of the chunk
+    param: safe: number of squares without a mine
+    """
+
+    __slots__ = ("field", "unopened", "touched")
+
+    def __init__(self, field, safe):
+        self.field = field
+        self.unopened = safe
+        self.touched = 0
+
+class ChunkedGame(BaseGame):
+    """
+    One game of minesweeper on a board too large to create up front.
+
+    The board is split into CHUNK_SIZE x CHUNK_SIZE chunks. The mines of each chunk
+    are chosen with a generator seeded from the seed of the game and the position of the chunk,
+    so a chunk can be made again at any time, and always has the same mines,
+    density times its size of them.
+    A chunk is only made when a square in it is opened, flagged or its number is needed.
+    Unopened chunks are shown as unopened squares without making them.
+
+    At most CHUNK_CACHE_SIZE chunks are kept in memory, besides partly opened ones.
+    When there are more, the least recently used chunk that is either untouched,
+    or has all its safe squares opened, is forgotten.
+    Only the flags of an opened chunk are remembered, the rest is made again when needed.
+    Chunks on the screen, as last given to set_visible, are not forgotten.
+
+    Used like Game, apart from not having a field or empty areas of the whole board.
+
+    param: width, height: size of the field
+    param: density: fraction of squares with a mine, between 0 and 1
+    param: seed: seed for placing mines, same seed gives the same field. Random if not given
+    """
+
+    def __init__(self, width, height, density, seed=None):
+        if density <= 0:
+            raise ValueError("Not enough mines!")
+        if density >= 1:
+            raise ValueError("Too many mines!")
+
+        self.density = density
+        mines = 0
+        full_columns, last_width = divmod(width, CHUNK_SIZE)
+        full_rows, last_height = divmod(height, CHUNK_SIZE)
+        for chunk_width, columns in ((CHUNK_SIZE, full_columns), (last_width, 1)):
+            for chunk_height, rows in ((CHUNK_SIZE, full_rows), (last_height, 1)):
+                mines += columns*rows*self.mine_count(chunk_width*chunk_height)
+
+        BaseGame.__init__(self, width, height, mines, seed)
+        self.chunks = OrderedDict()
+        self.opened = {}
+        self.visible = (0, 0, 0, 0)
+
+    def chunk_size(self, chunk_x, chunk_y):
+        """
+        Returns the width and height of the given chunk. Chunks at the right and top edges may be smaller.
+
+        param: chunk_x, chunk_y: position of the chunk, in chunks
+        """
+
+        return (
+            min(CHUNK_SIZE, self.width - chunk_x*CHUNK_SIZE),
+            min(CHUNK_SIZE, self.height - chunk_y*CHUNK_SIZE)
+        )
+
+    def mine_count(self, cells):
+        """
+        Returns the number of mines in a chunk of the given number of squares.
+        Used both for placing mines and for counting them all, so the two always agree.
+
+        param: cells: number of squares in the chunk
+        """
+
+        return round(self.density*cells)
+
+    def chunk_mines(self, chunk_x, chunk_y):
+        """
+        Returns the positions of the mines in the given chunk, as indices within the chunk.
+        Always the same for the same seed and chunk.
+
+        param: chunk_x, chunk_y: position of the chunk, in chunks
+        """
+
+        chunk_width, chunk_height = self.chunk_size(chunk_x, chunk_y)
+        cells = chunk_width*chunk_height
+        generator = random.Random("{}:{}:{}".format(self.seed, chunk_x, chunk_y))
+        return generator.sample(range(cells), self.mine_count(cells))
+
+    def make_chunk(self, chunk_x, chunk_y):
+        """
+        Makes the given chunk: places its mines, counts the mines around its squares,
+        including mines in the chunks around it, and opens it again if it had been opened before.
+
+        param: chunk_x, chunk_y: position of the chunk, in chunks
+        """
+
+        chunk_width, chunk_height = self.chunk_size(chunk_x, chunk_y)
+        field = bytearray(chunk_width*chunk_height)
+        left = chunk_x*CHUNK_SIZE
+        bottom = chunk_y*CHUNK_SIZE
+        mine_count = 0
+        for i in range(max(chunk_y-1, 0), min(chunk_y+2, (self.height - 1)//CHUNK_SIZE + 1)):
+            for j in range(max(chunk_x-1, 0), min(chunk_x+2, (self.width - 1)//CHUNK_SIZE + 1)):
+                neighbour_width, _ = self.chunk_size(j, i)
+                own = i == chunk_y and j == chunk_x
+                for mine in self.chunk_mines(j, i):
+                    y, x = divmod(mine, neighbour_width)
+                    y += i*CHUNK_SIZE - bottom
+                    x += j*CHUNK_SIZE - left
+                    if own:
+                        field[y*chunk_width + x] |= MINE
+                        mine_count += 1
+                    for row in range(max(y-1, 0), min(y+2, chunk_height)):
+                        for column in range(max(x-1, 0), min(x+2, chunk_width)):
+                            field[row*chunk_width + column] += 1
+                    if own:
+                        field[y*chunk_width + x] -= 1
+
+        chunk = Chunk(field, len(field) - mine_count)
+        flags = self.opened.pop((chunk_x, chunk_y), None)
+        if flags is not None:
+            for index, square in enumerate(field):
+                if not square & MINE:
+                    field[index] = square | REVEALED
+            for index in flags:
+                field[index] |= FLAGGED
+            chunk.unopened = 0
+            chunk.touched = len(field) - mine_count + len(flags)
+        return chunk
+
+    def chunk(self, chunk_x, chunk_y):
+        """
+        Returns the given chunk, making it if it isn't in memory,
+        and forgets the least recently used chunk that can be forgotten if there are too many.
+
+        param: chunk_x, chunk_y: position of the chunk, in chunks
+        """
+
+        key = (chunk_x, chunk_y)
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            return chunk
+
+        if len(self.chunks) >= CHUNK_CACHE_SIZE:
+            self.evict()
+        chunk = self.make_chunk(chunk_x, chunk_y)
+        self.chunks[key] = chunk
+        return chunk
+
+    def set_visible(self, first_row, first_column, end_row, end_column):
+        """
+        Sets the squares shown on the screen, so their chunks aren't forgotten.
+
+        param: first_row, first_column: bottom left visible square
+        param: end_row, end_column: row and column after the top right visible square
+        """
+
+        self.visible = (
+            first_column // CHUNK_SIZE,
+            first_row // CHUNK_SIZE,
+            (end_column - 1) // CHUNK_SIZE + 1,
+            (end_row - 1) // CHUNK_SIZE + 1
+        )
+
+    def evict(self):
+        """
+        Forgets the least recently used chunk that is off the screen, and untouched or completely opened,
+        remembering the flags of an opened one. Partly opened chunks,
+        chunks with opened mines and chunks on the screen are never forgotten.
+        """
+
+        first_x, first_y, end_x, end_y = self.visible
+        for key, chunk in self.chunks.items():
+            if first_x <= key[0] < end_x and first_y <= key[1] < end_y:
+                continue
+            if chunk.touched == 0:
+                break
+            if chunk.unopened == 0 and not any(square & MINE and square & REVEALED for square in chunk.field):
+                self.opened[key] = [index for index, square in enumerate(chunk.field) if square & FLAGGED]
+                break
+        else:
+            return
+        del self.chunks[key]
+
+    def locate(self, row, column):
+        """
+        Returns the chunk of the given square and the index of the square in it.
+
+        param: row: row position of square
+        param: column: column position of square
+        """
+
+        chunk_y, y = divmod(row, CHUNK_SIZE)
+        chunk_x, x = divmod(column, CHUNK_SIZE)
+        chunk = self.chunk(chunk_x, chunk_y)
+        return chunk, y*min(CHUNK_SIZE, self.width - chunk_x*CHUNK_SIZE) + x
+
+    def square(self, row, column):
+        """
+        Returns the given square, making its chunk if it isn't in memory.
+
+        param: row: row position of square
+        param: column: column position of square
+        """
+
+        chunk, index = self.locate(row, column)
+        return chunk.field[index]
+
+    def shown_square(self, row, column):
+        """
+        Returns what the player sees in the given square, like Game.shown_square.
+        Squares of chunks never opened are shown as unopened without making the chunk.
+
+        param: row: row position of square
+        param: column: column position of square
+        """
+
+        key = (column // CHUNK_SIZE, row // CHUNK_SIZE)
+        if key not in self.chunks and key not in self.opened:
+            return " "
+        return BaseGame.shown_square(self, row, column)
+
+    def set_flag(self, row, column, flagged):
+        """
+        Puts a flag on the given square or removes it, and marks the square changed.
+        Flags keep a chunk from being forgotten while it is partly opened.
+
+        param: row: row position of square
+        param: column: column position of square
+        param: flagged: True to put a flag, False to remove it
+        """
+
+        chunk, index = self.locate(row, column)
+        if flagged:
+            chunk.field[index] |= FLAGGED
+            chunk.touched += 1
+        else:
+            chunk.field[index] &= ~FLAGGED
+            chunk.touched -= 1
+        self.changed.append((row, column))
+
+    def reveal_mines(self):
+        """
+        Shows the mines of the chunks in memory after losing, and removes their flags.
+        The rest of the board is left as it is.
+        """
+
+        for (chunk_x, chunk_y), chunk in self.chunks.items():
+            chunk_width, _ = self.chunk_size(chunk_x, chunk_y)
+            field = chunk.field
+            for index, square in enumerate(field):
+                if square & (MINE | FLAGGED):
+                    if square & MINE:
+                        field[index] = (square | REVEALED) & ~FLAGGED
+                    else:
+                        field[index] = square & ~FLAGGED
+                    y, x = divmod(index, chunk_width)
+                    self.changed.append((chunk_y*CHUNK_SIZE + y, chunk_x*CHUNK_SIZE + x))
+
+    def floodfill(self, starting_row, starting_column):
+        """
+        Opens up playarea, minesweeper style, across chunks.
+        Squares are opened as soon as they are found,
+        so each square is put on the checklist only once.
+
+        param: starting_row: row position on where to start
+        param: starting_column: column position on where to start
+        """
+
+        width = self.width
+        height = self.height
+        checklist = []
+        if self.open_square(starting_row, starting_column):
+            checklist.append((starting_row, starting_column))
+
+        while checklist:
+            y, x = checklist.pop()
+            for i in range(max(y-1, 0), min(y+2, height)):
+                for j in range(max(x-1, 0), min(x+2, width)):
+                    if self.open_square(i, j):
+                        checklist.append((i, j))
+
+    def open_square(self, row, column):
+        """
+        Opens one unopened square, removing its flag.
+        Returns True if the square was opened now and has no mines around it,
+        so the squares around it should be opened too.
+
+        param: row: row position of square
+        param: column: column position of square
+        """
+
+        chunk, index = self.locate(row, column)
+        square = chunk.field[index]
+        if square & REVEALED:
+            return False
+        chunk.field[index] = (square | REVEALED) & ~FLAGGED
+        chunk.unopened -= 1
+        self.revealed_safe += 1
+        if not square & FLAGGED:
+            chunk.touched += 1
+        self.changed.append((row, column))
+        return not square & COUNT_MASK
+
+    def pop_changes(self):
+        """
+        Returns the (row, column) positions of squares changed since the last call, and forgets them.
+        """
+
+        changes = self.changed
+        self.changed = []
+        return changes
@@ -27,8 +27,15 @@ if modifiers & sweeperlib.MOD_SHIFT:
     # somethinghappens
 """
 
+import json
+import time
+from collections import OrderedDict, deque
+
 import pyglet
-from pyglet.gl import glEnable, GL_TEXTURE_2D
+from pyglet.gl import (
+    glEnable, glDisable, glScissor, glPushMatrix, glPopMatrix, glTranslatef, glScalef,
+    GL_TEXTURE_2D, GL_SCISSOR_TEST, GL_TRIANGLES
+)
 
 MOUSE_LEFT = pyglet.window.mouse.LEFT
 MOUSE_MIDDLE = pyglet.window.mouse.MIDDLE
@@ -38,6 +45,23 @@ MOD_SHIFT = pyglet.window.key.MOD_SHIFT
 MOD_CTRL = pyglet.window.key.MOD_CTRL
 MOD_ALT = pyglet.window.key.MOD_ALT
 
+KEY_H = pyglet.window.key.H
+KEY_S = pyglet.window.key.S
+KEY_LEFT = pyglet.window.key.LEFT
+KEY_RIGHT = pyglet.window.key.RIGHT
+KEY_UP = pyglet.window.key.UP
+KEY_DOWN = pyglet.window.key.DOWN
+
+# Maximum number of text labels kept in the draw_text cache
+LABEL_CACHE_SIZE = 32
+
+# Size of the texture atlas the tile images are packed into
+ATLAS_SIZE = 256
+
+# Limits for the zoom level of the tile grid camera
+MIN_ZOOM = 0.25
+MAX_ZOOM = 4
+
 
 # Variables required for drawing graphics are saved to this dictionary so that
 # they can be easily accessed in all functions. A similar solution is
@@ -49,14 +73,61 @@ graphics = {
     "bg_color": None,
     "batch": None,
     "sprites": [],
-    "images": {}
+    "images": {},
+    "atlas": None,
+    "tex_coords": {},
+    "tile_batch": None,
+    "tile_vertices": None,
+    "tile_keys": [],
+    "tile_key_function": None,
+    "tile_columns": 0,
+    "tile_rows": 0,
+    "tile_size": 40,
+    "tile_range": None,
+    "viewport": (0, 0, 0, 0),
+    "camera": {"x": 0, "y": 0, "zoom": 1},
+    "labels": OrderedDict(),
+    "sprite_path": None,
+    "persistent": False,
+    "on_demand": False,
+    "dirty": True
 }
 
 handlers = {
     "timeouts": [],
 }
 
-glEnable(GL_TEXTURE_2D)
+# Measurements of the profiling mode, see set_profiling. Durations of each
+# handler are counted in a histogram of powers of two microseconds: bucket n
+# holds calls that took less than 2**n but at least 2**(n-1) microseconds.
+profiling = {
+    "enabled": False,
+    "overlay": True,
+    "output": None,
+    "handlers": {},
+    "frames": deque(),
+    "late_ticks": 0,
+    "overlay_text": "",
+    "overlay_updated": 0
+}
+
+class _OnDemandEventLoop(pyglet.app.EventLoop):
+    """
+    Event loop used in redraw-on-demand mode. Scheduled functions are called
+    as usual, but windows are only redrawn after request_redraw has been
+    called, instead of after every scheduled function or input event.
+    """
+
+    def idle(self):
+        dt = self.clock.update_time()
+        self.clock.call_scheduled_functions(dt)
+        if graphics["dirty"]:
+            graphics["dirty"] = False
+            for window in pyglet.app.windows:
+                window.switch_to()
+                window.dispatch_event("on_draw")
+                window.flip()
+        return self.clock.get_sleep_time(True)
 
 def load_sprites(path):
     """
@@ -65,29 +136,40 @@ def load_sprites(path):
     want to add more graphics, you can use this function as an example of how
     to load them.
     
-    The function uses Pyglet's resouce module which loads the images in a
-    rather intelligent way. References to individual images are stored to a 
-    dictionary so that they can be readily accessed later. The dictionary keys
-    0 to 8 correspond to opened tiles, x to mines, f to flags, and space to 
-    unopened tiles.
+    The function uses Pyglet's resouce module to find the images, and packs
+    them all into one texture atlas, so that any number of tiles can be drawn
+    with one texture (see create_tile_grid). References to individual images
+    are stored to a dictionary so that they can be readily accessed later. The
+    dictionary keys 0 to 8 correspond to opened tiles, x to mines, f to flags,
+    and space to unopened tiles.
     
     The size of the default sprites is 40x40 pixels.
 
     Path should be given as relative, from where your code files are (see
-    example at the end of this module).
+    example at the end of this module). Loading the same path again does
+    nothing, the images loaded the first time are used. Call this after
+    create_window, as the images are sent to the graphics card of the window.
     
     :param str path: path to the sprites folder
     """
 
+    if graphics["sprite_path"] == path:
+        return
     pyglet.resource.path = [path]
-    images = {}
-    images["0"] = pyglet.resource.image("tile_empty.png")
+    pyglet.resource.reindex()
+    files = {"0": "tile_empty.png", "x": "tile_mine.png", " ": "tile_back.png", "f": "tile_flag.png"}
     for i in range(1, 9):
-        images[str(i)] = pyglet.resource.image("tile_{}.png".format(i))
-    images["x"] = pyglet.resource.image("tile_mine.png")
-    images[" "] = pyglet.resource.image("tile_back.png")
-    images["f"] = pyglet.resource.image("tile_flag.png")
+        files[str(i)] = "tile_{}.png".format(i)
+
+    atlas = pyglet.image.atlas.TextureAtlas(ATLAS_SIZE, ATLAS_SIZE)
+    images = {}
+    for key, filename in files.items():
+        with pyglet.resource.file(filename) as file:
+            images[key] = atlas.add(pyglet.image.load(filename, file=file), border=1)
+    graphics["atlas"] = atlas
     graphics["images"] = images
+    graphics["tex_coords"] = {key: tuple(image.tex_coords) for key, image in images.items()}
+    graphics["sprite_path"] = path
 
 def create_window(width=800, height=600, bg_color=(240, 240, 240, 255)):
     """
@@ -96,13 +178,29 @@ def create_window(width=800, height=600, bg_color=(240, 240, 240, 255)):
     creates a 800x600 pixel window with light grey background. These can be
     changed by providing optional arguments to the function.
     
+    In a persistent session (see set_persistent_session) the window is only
+    created the first time. After that, the same window is resized and shown
+    again.
+
     :param int width: window width
     :param int height: window height
     :param tuple bg_color: background color, tuple containing four values
                            (0-255, RGBA)
     """
 
+    if graphics["persistent"] and graphics["window"] is not None:
+        graphics["bg_color"] = bg_color
+        resize_window(width, height)
+        graphics["window"].set_visible(True)
+        return
+
     graphics["window"] = pyglet.window.Window(width, height, resizable=True)
+    glEnable(GL_TEXTURE_2D)
+    graphics["window"].push_handlers(
+        on_expose=request_redraw,
+        on_resize=lambda width, height: request_redraw(),
+        on_close=_on_close
+    )
     graphics["bg_color"] = bg_color
     graphics["background"] = pyglet.sprite.Sprite(
         pyglet.image.SolidColorImagePattern(bg_color).create_image(width, height)
@@ -120,6 +218,36 @@ def resize_window(width, height):
     graphics["background"] = pyglet.sprite.Sprite(
         pyglet.image.SolidColorImagePattern(graphics["bg_color"]).create_image(width, height)
     )
+    request_redraw()
+
+def set_redraw_on_demand(enabled=True):
+    """
+    Switches redraw-on-demand mode on or off. By default Pyglet redraws the
+    window every time a scheduled function (such as the interval handler) has
+    been called or an input event has arrived, which with the default 1/60
+    interval means 60 full redraws per second even when nothing on the screen
+    changes. In redraw-on-demand mode the window is only redrawn after
+    request_redraw has been called, so your handlers need to call it whenever
+    they change something that is visible. Window exposure and resizing
+    request a redraw automatically.
+
+    Call this before start.
+
+    :param bool enabled: True to only redraw on request, False for the
+                         default behaviour
+    """
+
+    graphics["on_demand"] = enabled
+
+def request_redraw():
+    """
+    Marks the window as needing a redraw. In redraw-on-demand mode the draw
+    handler is called once on the next iteration of the event loop, no matter
+    how many times this was called before that. Outside redraw-on-demand mode
+    this does nothing harmful, as the window is redrawn anyway.
+    """
+
+    graphics["dirty"] = True
 
 
 def set_mouse_handler(handler):
@@ -148,7 +276,7 @@ def set_mouse_handler(handler):
     """
 
     if graphics["window"]:
-        graphics["window"].on_mouse_press = handler
+        graphics["window"].on_mouse_press = _profiled("mouse", handler)
     else:
         print("Window hasn't been created!")
 
@@ -179,7 +307,26 @@ def set_keyboard_handler(handler):
     """
 
     if graphics["window"]:
-        graphics["window"].on_key_press = handler
+        graphics["window"].on_key_press = _profiled("keyboard", handler)
+    else:
+        print("Window hasn't been created!")
+
+def set_scroll_handler(handler):
+    """
+    Sets a function that is used to handle the mouse scroll wheel. The handler
+    must have four parameters: x, y, scroll_x and scroll_y. X and y are the
+    mouse position in the window, scroll_y is the number of clicks the wheel
+    was turned up (negative for down) and scroll_x the same for sideways
+    scrolling, which most mice don't have.
+
+    def scroll_handler(x, y, scroll_x, scroll_y):
+        # things happen
+
+    :param function handler: handler function for scrolling
+    """
+
+    if graphics["window"]:
+        graphics["window"].on_mouse_scroll = _profiled("scroll", handler)
     else:
         print("Window hasn't been created!")
 
@@ -194,13 +341,15 @@ def set_draw_handler(handler):
     begin_sprite_draw (called before drawing the game tiles)
     prepare_sprite (prepares a sprite to be drawn)
     draw_sprites (draws all prepared sprites at once)
+    update_tile_grid (updates a persistent tile grid, see create_tile_grid)
+    draw_tile_grid (draws the persistent tile grid at once)
     draw_text (writes some text - optional)
     
     :param function handler: handler function for drawing
     """
 
     if graphics["window"]:
-        graphics["window"].on_draw = handler
+        graphics["window"].on_draw = _profiled("draw", handler)
     else:
         print("Window hasn't been created!")
 
@@ -225,6 +374,7 @@ def set_interval_handler(handler, interval=1/60):
     :param float toistovali: interval between calls, default 1/60
     """
 
+    handler = _profiled("interval", handler, interval)
     pyglet.clock.schedule_interval(handler, interval)
     handlers["timeouts"].append(handler)
 
@@ -234,6 +384,9 @@ def start():
     calling this.
     """
 
+    if graphics["on_demand"]:
+        graphics["dirty"] = True
+        pyglet.app.event_loop = _OnDemandEventLoop()
     pyglet.app.run()
 
 def close():
@@ -241,14 +394,191 @@ def close():
     Closes the window and exits the game loop. You can use this to return from
     the game window back to a text-based terminal menu. Note that in order to
     restart the game after this, you need to create the window and set the
-    handlers again.
+    handlers again. In a persistent session the window is only hidden, and
+    creating it again is quick.
     """
 
-    graphics["window"].close()
+    if profiling["enabled"] and profiling["output"]:
+        with open(profiling["output"], "w") as file:
+            json.dump(profiling_report(), file, indent=2)
+    if graphics["persistent"]:
+        graphics["window"].set_visible(False)
+    else:
+        _destroy_window()
     for handler in handlers["timeouts"]:
         pyglet.clock.unschedule(handler)
+    handlers["timeouts"].clear()
     pyglet.app.exit()
 
+def set_persistent_session(enabled=True):
+    """
+    Switches persistent session mode on or off. Normally close destroys the
+    window, and each game has to create a new window and OpenGL context. In a
+    persistent session close hides the window instead, and create_window
+    resizes and shows the same window again, so that games played one after
+    another start without delay. Closing the window from its close button
+    also only hides it. Call end_session when the program is done with the
+    window.
+
+    :param bool enabled: True to keep the window between games
+    """
+
+    graphics["persistent"] = enabled
+
+def end_session():
+    """
+    Ends a persistent session and destroys the window, see
+    set_persistent_session.
+    """
+
+    graphics["persistent"] = False
+    if graphics["window"] is not None:
+        _destroy_window()
+
+def _destroy_window():
+    """
+    Closes the window for good, along with the text labels drawn in it.
+    """
+
+    graphics["window"].close()
+    graphics["window"] = None
+    for text_box in graphics["labels"].values():
+        text_box.delete()
+    graphics["labels"].clear()
+
+def _on_close():
+    """
+    Handles the close button of the window. In a persistent session, returns
+    to the caller of start like close does, keeping the window; otherwise
+    lets Pyglet close the window as usual.
+    """
+
+    if graphics["persistent"]:
+        close()
+        return pyglet.event.EVENT_HANDLED
+    return None
+
+def set_profiling(enabled=True, overlay=True, output=None):
+    """
+    Switches profiling mode on or off. In profiling mode every handler set
+    after this is timed, so call this before setting the handlers. Durations
+    are counted in a histogram for each handler, which costs about a
+    microsecond per call. The frame rate is followed from calls to the draw
+    handler, and calls of the interval handler that come late enough to miss
+    one or more intervals are counted.
+
+    With overlay, the frame rate and frame time percentiles are written in the
+    top left corner of the window after the draw handler has drawn. With
+    output, the measurements are saved as JSON to the given file when the
+    window is closed. They can also be read at any time with profiling_report.
+
+    :param bool enabled: True to measure handlers, False to stop
+    :param bool overlay: True to show measurements in the window
+    :param str output: path of a JSON file for the measurements, optional
+    """
+
+    profiling["enabled"] = enabled
+    profiling["overlay"] = overlay
+    profiling["output"] = output
+
+def _profiled(name, handler, interval=None):
+    """
+    Returns the handler wrapped to measure its calls in profiling mode, or the
+    handler itself if profiling is off. The draw handler also gets the overlay.
+    """
+
+    if not profiling["enabled"]:
+        return handler
+    stats = profiling["handlers"].setdefault(name, {
+        "calls": 0,
+        "total": 0,
+        "max": 0,
+        "histogram": [0] * 32
+    })
+
+    def measure(start):
+        duration = time.perf_counter() - start
+        stats["calls"] += 1
+        stats["total"] += duration
+        stats["max"] = max(stats["max"], duration)
+        stats["histogram"][min(int(duration * 1000000).bit_length(), 31)] += 1
+
+    def profiled_handler(*args):
+        start = time.perf_counter()
+        handler(*args)
+        measure(start)
+        if interval is not None and args[0] > interval * 1.5:
+            profiling["late_ticks"] += round(args[0] / interval) - 1
+        if name == "draw":
+            frames = profiling["frames"]
+            frames.append(start)
+            while frames[0] < start - 1:
+                frames.popleft()
+            if profiling["overlay"]:
+                _draw_profiling_overlay(start)
+
+    return profiled_handler
+
+def _percentile(histogram, fraction):
+    """
+    Returns the upper limit of the histogram bucket where the given fraction
+    of calls is reached, in milliseconds, or 0 if there are no calls.
+    """
+
+    total = sum(histogram)
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        seen += count
+        if count and seen >= total * fraction:
+            return 2 ** bucket / 1000
+    return 0
+
+def profiling_report():
+    """
+    Returns the measurements of profiling mode as a dictionary: for each
+    handler the number of calls, mean and maximum duration, 50th, 95th and
+    99th percentile durations (in milliseconds, rounded up to a power of two
+    microseconds) and the histogram, and the frame rate during the last second
+    and the number of missed intervals.
+    """
+
+    now = time.perf_counter()
+    report = {
+        "fps": sum(1 for frame in profiling["frames"] if frame >= now - 1),
+        "missed_intervals": profiling["late_ticks"],
+        "handlers": {}
+    }
+    for name, stats in profiling["handlers"].items():
+        report["handlers"][name] = {
+            "calls": stats["calls"],
+            "mean_ms": stats["total"] / stats["calls"] * 1000 if stats["calls"] else 0,
+            "max_ms": stats["max"] * 1000,
+            "p50_ms": _percentile(stats["histogram"], 0.5),
+            "p95_ms": _percentile(stats["histogram"], 0.95),
+            "p99_ms": _percentile(stats["histogram"], 0.99),
+            "histogram_us": stats["histogram"]
+        }
+    return report
+
+def _draw_profiling_overlay(now):
+    """
+    Draws the frame rate and draw handler percentiles over the window. The
+    text is only updated twice a second, so the overlay doesn't make a new
+    text layout for every frame.
+    """
+
+    if now - profiling["overlay_updated"] > 0.5:
+        profiling["overlay_updated"] = now
+        histogram = profiling["handlers"]["draw"]["histogram"]
+        profiling["overlay_text"] = "{} fps  draw p50 {:.2f} p95 {:.2f} p99 {:.2f} ms  missed {}".format(
+            len(profiling["frames"]),
+            _percentile(histogram, 0.5),
+            _percentile(histogram, 0.95),
+            _percentile(histogram, 0.99),
+            profiling["late_ticks"]
+        )
+    draw_text(profiling["overlay_text"], 5, graphics["window"].height - 15, (255, 0, 0, 255), "monospace", 9)
+
 def clear_window():
     """
     Clears away everything from the window.
@@ -274,6 +604,11 @@ def draw_text(text, x, y, color=(0, 0, 0, 255), font="serif", size=32):
     of the text.
     
     Text, if any, should be drawn last.
+
+    Labels are cached by font, size, color and position, so drawing the same
+    spot again only updates the text if it has changed. At most
+    LABEL_CACHE_SIZE labels are kept; the least recently used one is
+    discarded when the cache is full.
     
     :param str text: string to display
     :param int x: bottom left x coordinate for the text
@@ -283,13 +618,25 @@ def draw_text(text, x, y, color=(0, 0, 0, 255), font="serif", size=32):
     :param int size: fontin size as points
     """
 
-    text_box = pyglet.text.Label(text,
-        font_name=font,
-        font_size=size,
-        color=color,
-        x=x, y=y,
-        anchor_x="left", anchor_y="bottom"
-    )
+    key = (font, size, tuple(color), x, y)
+    labels = graphics["labels"]
+    text_box = labels.get(key)
+    if text_box is None:
+        text_box = pyglet.text.Label(text,
+            font_name=font,
+            font_size=size,
+            color=color,
+            x=x, y=y,
+            anchor_x="left", anchor_y="bottom"
+        )
+        labels[key] = text_box
+        if len(labels) > LABEL_CACHE_SIZE:
+            _, evicted = labels.popitem(last=False)
+            evicted.delete()
+    else:
+        labels.move_to_end(key)
+        if text_box.text != text:
+            text_box.text = text
     text_box.draw()
 
 def begin_sprite_draw():
@@ -335,6 +682,322 @@ def draw_sprites():
     graphics["batch"].draw()
     graphics["sprites"].clear()
 
+def create_tile_grid(field, tile_size=40):
+    """
+    Creates a persistent tile grid for the given field. Unlike the
+    begin_sprite_draw / prepare_sprite / draw_sprites trio, which builds every
+    sprite from scratch on each frame, the grid is one long-lived vertex list
+    of squares textured from the sprite atlas (see load_sprites): changing a
+    tile only rewrites its texture coordinates, and the whole grid is drawn
+    with one draw call, without a Python object for each tile. The field is a
+    list of rows, where each row is a list of sprite keys (see prepare_sprite).
+    Row 0 is drawn at the bottom of the window.
+
+    The grid may be much larger than the window. It is seen through a camera
+    that can be moved and zoomed (see move_camera and zoom_camera), and the
+    vertex list only covers the tiles inside the viewport: when the camera
+    moves, the texture coordinates are written again for the tiles that are
+    now in view. So the cost of drawing depends on the size of the window
+    instead of the size of the field. By default the viewport is the whole
+    window, use set_viewport to leave room for other things.
+
+    Call this once after the window has been created and the sprites have
+    been loaded, and after that use update_tile and draw_tile_grid in your
+    handlers.
+
+    :param list field: list of rows containing sprite keys
+    :param int tile_size: width and height of one tile in pixels
+    """
+
+    keys = [[str(square).lower() for square in row] for row in field]
+    _reset_tile_grid(len(keys[0]) if keys else 0, len(keys), tile_size)
+    graphics["tile_keys"] = keys
+    _view_whole_window()
+
+def create_lazy_tile_grid(width, height, key_function, tile_size=40):
+    """
+    Creates a tile grid like create_tile_grid, but without a list of the whole
+    field: the key of a tile is asked from the given function when the tile
+    comes into view. This is meant for fields too large to keep a key for
+    every tile. The function gets the column and row of the tile (x_index,
+    y_index), and returns its sprite key (see prepare_sprite). Keys are not
+    stored, so update_tile always redraws a tile in view.
+
+    :param int width: number of columns in the field
+    :param int height: number of rows in the field
+    :param function key_function: function returning the key of a tile
+    :param int tile_size: width and height of one tile in pixels
+    """
+
+    _reset_tile_grid(width, height, tile_size)
+    graphics["tile_key_function"] = key_function
+    _view_whole_window()
+
+def _reset_tile_grid(columns, rows, tile_size):
+    """
+    Removes the old tile grid, and sets up an empty one of the given size.
+    """
+
+    if graphics["tile_vertices"] is not None:
+        graphics["tile_vertices"].delete()
+    graphics["tile_batch"] = pyglet.graphics.Batch()
+    graphics["tile_vertices"] = None
+    graphics["tile_keys"] = None
+    graphics["tile_key_function"] = None
+    graphics["tile_columns"] = columns
+    graphics["tile_rows"] = rows
+    graphics["tile_size"] = tile_size
+    graphics["tile_range"] = None
+
+def _view_whole_window():
+    """
+    Puts the camera of a new tile grid to the bottom left corner, viewing the whole window.
+    """
+
+    graphics["camera"] = {"x": 0, "y": 0, "zoom": 1}
+    window = graphics["window"]
+    set_viewport(0, 0, window.width, window.height)
+
+def set_viewport(x, y, width, height):
+    """
+    Sets the area of the window where the tile grid is shown, for example to
+    leave room for a status bar. Tiles are not drawn outside this area.
+
+    :param int x: bottom left x coordinate of the area
+    :param int y: bottom left y coordinate of the area
+    :param int width: width of the area
+    :param int height: height of the area
+    """
+
+    graphics["viewport"] = (x, y, width, height)
+    _clamp_camera()
+    _cull_tile_grid()
+    request_redraw()
+
+def move_camera(dx, dy):
+    """
+    Scrolls the tile grid by the given amount of pixels on the screen.
+    The camera stops at the edges of the grid.
+
+    :param float dx: pixels to scroll right
+    :param float dy: pixels to scroll up
+    """
+
+    camera = graphics["camera"]
+    camera["x"] += dx / camera["zoom"]
+    camera["y"] += dy / camera["zoom"]
+    _clamp_camera()
+    _cull_tile_grid()
+    request_redraw()
+
+def zoom_camera(factor, x, y):
+    """
+    Zooms the tile grid in (factor above 1) or out (factor below 1), keeping
+    the point under the given window coordinates in place, so that zooming
+    follows e.g. the mouse. Zoom is limited between MIN_ZOOM and MAX_ZOOM.
+
+    :param float factor: multiplier for the zoom level
+    :param int x: x coordinate to zoom around
+    :param int y: y coordinate to zoom around
+    """
+
+    camera = graphics["camera"]
+    view_x, view_y, _, _ = graphics["viewport"]
+    world_x = camera["x"] + (x - view_x) / camera["zoom"]
+    world_y = camera["y"] + (y - view_y) / camera["zoom"]
+    camera["zoom"] = min(max(camera["zoom"] * factor, MIN_ZOOM), MAX_ZOOM)
+    camera["x"] = world_x - (x - view_x) / camera["zoom"]
+    camera["y"] = world_y - (y - view_y) / camera["zoom"]
+    _clamp_camera()
+    _cull_tile_grid()
+    request_redraw()
+
+def screen_to_tile(x, y):
+    """
+    Returns the tile under the given window coordinates as a tuple of column
+    and row (x_index, y_index), taking the camera into account. Returns None
+    if there's no tile under the coordinates.
+
+    :param int x: x coordinate in the window
+    :param int y: y coordinate in the window
+    """
+
+    camera = graphics["camera"]
+    view_x, view_y, view_width, view_height = graphics["viewport"]
+    if not (view_x <= x < view_x + view_width and view_y <= y < view_y + view_height):
+        return None
+    x_index = int((camera["x"] + (x - view_x) / camera["zoom"]) // graphics["tile_size"])
+    y_index = int((camera["y"] + (y - view_y) / camera["zoom"]) // graphics["tile_size"])
+    if 0 <= y_index < graphics["tile_rows"] and 0 <= x_index < graphics["tile_columns"]:
+        return x_index, y_index
+    return None
+
+def tile_to_screen(x_index, y_index):
+    """
+    Returns where the given tile is in the window, as a tuple of its bottom
+    left x and y coordinates and its size on the screen. Returns None if the
+    tile is not inside the viewport. Useful for drawing things on top of tiles.
+
+    :param int x_index: column of the tile
+    :param int y_index: row of the tile
+    """
+
+    camera = graphics["camera"]
+    view_x, view_y, view_width, view_height = graphics["viewport"]
+    size = graphics["tile_size"] * camera["zoom"]
+    x = view_x + (x_index * graphics["tile_size"] - camera["x"]) * camera["zoom"]
+    y = view_y + (y_index * graphics["tile_size"] - camera["y"]) * camera["zoom"]
+    if x + size <= view_x or x >= view_x + view_width or y + size <= view_y or y >= view_y + view_height:
+        return None
+    return x, y, size
+
+def visible_tiles():
+    """
+    Returns the tiles visible through the camera as a tuple of the first
+    column, first row, and the column and row after the last ones
+    (first_x, first_y, end_x, end_y). Returns None if there's no tile grid.
+    """
+
+    if graphics["tile_range"] is None:
+        return None
+    first_row, first_column, last_row, last_column = graphics["tile_range"]
+    return first_column, first_row, last_column, last_row
+
+def _clamp_camera():
+    """
+    Keeps the camera inside the tile grid. A grid smaller than the viewport
+    stays in its bottom left corner.
+    """
+
+    camera = graphics["camera"]
+    _, _, view_width, view_height = graphics["viewport"]
+    grid_width = graphics["tile_columns"] * graphics["tile_size"]
+    grid_height = graphics["tile_rows"] * graphics["tile_size"]
+    camera["x"] = min(max(camera["x"], 0), max(grid_width - view_width / camera["zoom"], 0))
+    camera["y"] = min(max(camera["y"], 0), max(grid_height - view_height / camera["zoom"], 0))
+
+def _cull_tile_grid():
+    """
+    Fills the vertex list of the tile grid with the tiles that are visible
+    through the camera. Does nothing if the visible rows and columns haven't
+    changed. The squares of the vertex list are always at the same place, the
+    first visible tile at origin, so only their texture coordinates need to be
+    written when the camera moves; the list is only made again when the number
+    of visible rows or columns changes.
+    """
+
+    if graphics["tile_batch"] is None or not graphics["tile_rows"] or not graphics["tile_columns"]:
+        return
+    camera = graphics["camera"]
+    _, _, view_width, view_height = graphics["viewport"]
+    size = graphics["tile_size"]
+    first_row = int(camera["y"] // size)
+    first_column = int(camera["x"] // size)
+    last_row = min(int((camera["y"] + view_height / camera["zoom"]) // size) + 1, graphics["tile_rows"])
+    last_column = min(int((camera["x"] + view_width / camera["zoom"]) // size) + 1, graphics["tile_columns"])
+    tile_range = (first_row, first_column, last_row, last_column)
+    if tile_range == graphics["tile_range"]:
+        return
+
+    rows = max(last_row - first_row, 0)
+    columns = max(last_column - first_column, 0)
+    old_range = graphics["tile_range"]
+    if old_range is None or (old_range[2] - old_range[0], old_range[3] - old_range[1]) != (rows, columns):
+        if graphics["tile_vertices"] is not None:
+            graphics["tile_vertices"].delete()
+        vertices = []
+        indices = []
+        for i in range(rows):
+            for j in range(columns):
+                x = j * size
+                y = i * size
+                vertices.extend((x, y, x + size, y, x + size, y + size, x, y + size))
+                n = len(indices) // 6 * 4
+                indices.extend((n, n + 1, n + 2, n, n + 2, n + 3))
+        graphics["tile_vertices"] = graphics["tile_batch"].add_indexed(
+            rows * columns * 4,
+            GL_TRIANGLES,
+            pyglet.graphics.TextureGroup(graphics["atlas"].texture),
+            indices,
+            ("v2f/static", vertices),
+            ("t3f/dynamic", [0] * (rows * columns * 12))
+        )
+
+    tex_coords = graphics["tex_coords"]
+    keys = graphics["tile_keys"]
+    key_function = graphics["tile_key_function"]
+    coordinates = []
+    for i in range(first_row, last_row):
+        if keys is not None:
+            for key in keys[i][first_column:last_column]:
+                coordinates.extend(tex_coords[key])
+        else:
+            for j in range(first_column, last_column):
+                coordinates.extend(tex_coords[str(key_function(j, i)).lower()])
+    graphics["tile_vertices"].tex_coords[:] = coordinates
+    graphics["tile_range"] = tile_range
+
+def update_tile(x_index, y_index, key):
+    """
+    Changes the image of a single tile in the tile grid, by rewriting the
+    texture coordinates of its square. Only the key is stored if the tile is
+    outside the viewport, and nothing is done if the key is the same one the
+    tile is currently showing.
+
+    :param int x_index: column of the tile
+    :param int y_index: row of the tile
+    :param str key: key, used to select the sprite
+    """
+
+    key = str(key).lower()
+    keys = graphics["tile_keys"]
+    if keys is not None:
+        if keys[y_index][x_index] == key:
+            return
+        keys[y_index][x_index] = key
+    first_row, first_column, last_row, last_column = graphics["tile_range"]
+    if first_row <= y_index < last_row and first_column <= x_index < last_column:
+        n = ((y_index - first_row) * (last_column - first_column) + x_index - first_column) * 12
+        graphics["tile_vertices"].tex_coords[n:n + 12] = graphics["tex_coords"][key]
+
+def update_tile_grid(field):
+    """
+    Compares the given field to what the tile grid is currently showing and
+    swaps the images of those tiles whose value has changed. The field must
+    have the same dimensions as the one given to create_tile_grid. This goes
+    through the whole field, so for large fields prefer update_tile for the
+    tiles you know have changed.
+
+    :param list field: list of rows containing sprite keys
+    """
+
+    for i, row in enumerate(field):
+        for j, square in enumerate(row):
+            update_tile(j, i, square)
+
+def draw_tile_grid():
+    """
+    Draws the visible part of the tile grid with one draw call, as seen
+    through the camera, clipped to the viewport.
+    """
+
+    camera = graphics["camera"]
+    view_x, view_y, view_width, view_height = graphics["viewport"]
+    first_row, first_column, _, _ = graphics["tile_range"]
+    size = graphics["tile_size"]
+    glEnable(GL_SCISSOR_TEST)
+    glScissor(int(view_x), int(view_y), int(view_width), int(view_height))
+    glPushMatrix()
+    glTranslatef(
+        view_x + (first_column * size - camera["x"]) * camera["zoom"],
+        view_y + (first_row * size - camera["y"]) * camera["zoom"],
+        0
+    )
+    glScalef(camera["zoom"], camera["zoom"], 1)
+    graphics["tile_batch"].draw()
+    glPopMatrix()
+    glDisable(GL_SCISSOR_TEST)
+
 if __name__ == "__main__":
     # Disabling two pylint warnings because it would complain about the test
     # code despite it being perfectly valid.
@@ -342,8 +1005,8 @@ if __name__ == "__main__":
 
     # images are loaded from the sprites subfolder which must be in the same
     # folder as this code file
-    load_sprites("sprites")
     create_window()
+    load_sprites("sprites")
 
     def draw():
         clear_window()